@@ -0,0 +1,207 @@
+from array import array
+from blackjackgame import BlackjackGame
+from blackjackgamerunner import BlackjackGameRunner
+from deck import HI_LO
+from itertools import accumulate, chain, repeat
+import math
+import operator
+import random
+
+
+def record_hands(responder, n, rules=None, tags=HI_LO):
+    """Plays n hands and records the per-hand outcome stream
+
+    Args:
+        responder:  Responder function playing the hands, see
+                    BlackjackGameRunner.run
+        n:          Number of hands to record
+        rules:      The RuleSet to play by, the defaults if None
+        tags:       Tag system used for the true count
+
+    Returns:
+        A tuple of two arrays: the net score of each hand and the true count
+        it was dealt at
+    """
+    scores = array('d')
+    counts = array('l')
+
+    def recorder(state):
+        response = responder(state)
+        if not state['active']:
+            scores.append(game.score)
+            counts.append(state['deal_true_count'])
+        return response
+
+    game = BlackjackGame(track_count=True, tags=tags, rules=rules,
+                         naturals=True)
+    BlackjackGameRunner(game).run(recorder, n=n)
+    return scores, counts
+
+
+class BetSpread:
+    """Bet sizing rule mapping the true count to a bet in units
+
+    Counts below the lowest ramp entry bet `min_bet`, counts above the
+    highest entry bet that entry's amount.
+
+        spread = BetSpread({1: 2, 2: 4, 3: 8})   # a 1-8 spread
+    """
+
+    def __init__(self, ramp=None, min_bet=1):
+        """Creates the rule
+
+        Args:
+            ramp:       Dict of true count to bet, the bet applies to that
+                        count and above until the next entry. A flat bet of
+                        `min_bet` is used if None
+            min_bet:    Bet below the first ramp entry
+        """
+        ramp = ramp or {}
+        self._low = min(ramp, default=0)
+        self._high = max(ramp, default=0)
+
+        bet = min_bet
+        self._table = []
+        for count in range(self._low, self._high + 1):
+            bet = ramp.get(count, bet)
+            self._table.append(bet)
+        self._min_bet = min_bet
+
+    def __call__(self, true_count):
+        """Bet for a single true count"""
+        if true_count < self._low:
+            return self._min_bet
+        return self._table[min(true_count, self._high) - self._low]
+
+    def bets(self, counts):
+        """Bets for a whole array of true counts
+
+        Clipping and lookups run through map over C functions, so there is
+        no Python-level work per hand.
+        """
+        # Slot 0 holds min_bet for every count below the ramp
+        table = [self._min_bet] + self._table
+        offset = 1 - self._low
+        shifted = map(operator.add, counts, repeat(offset))
+        clipped = map(min, map(max, shifted, repeat(0)),
+                      repeat(len(table) - 1))
+        return array('d', map(table.__getitem__, clipped))
+
+
+class BankrollSimulator:
+    """Session and risk of ruin simulation over a recorded outcome stream
+
+    Bets from the bet rule are applied to the whole stream at once, and a
+    single prefix sum turns the stream into a bankroll curve. Each session
+    is then a window of that curve: its result is a difference of two prefix
+    sums, its lowest point a `min` over the window, and its drawdown comes
+    from a running maximum built with itertools.accumulate, all of which loop
+    in C. Sessions are contiguous windows, which keeps the count's
+    correlation between neighbouring hands.
+
+    The windows of one simulation never overlap: sessions sharing hands
+    would be correlated and understate the spread of results and the risk
+    of ruin. A stream of n hands therefore supports at most n // hands
+    sessions, so record at least sessions * hands hands.
+    """
+
+    def __init__(self, scores, counts=None, bet_rule=None):
+        """Prepares the bankroll curve
+
+        Args:
+            scores:     Net score per hand for a one unit bet
+            counts:     True count each hand was dealt at, required when the
+                        bet rule depends on the count
+            bet_rule:   A BetSpread, flat one unit bets if None
+        """
+        if bet_rule is not None and counts is None:
+            raise ValueError("A bet rule needs the true counts")
+        if bet_rule is None:
+            self._wins = array('d', scores)
+            self._bets = array('d', [1.0]) * len(scores)
+        else:
+            self._bets = bet_rule.bets(counts)
+            self._wins = array('d', map(operator.mul, scores, self._bets))
+        self._curve = array('d', accumulate(chain([0.0], self._wins)))
+
+    def __len__(self):
+        """Number of hands in the stream"""
+        return len(self._wins)
+
+    @property
+    def ev_per_hand(self):
+        """Average win per hand, in units"""
+        return self._curve[-1] / len(self._wins)
+
+    @property
+    def average_bet(self):
+        """Average bet per hand, in units"""
+        return math.fsum(self._bets) / len(self._bets)
+
+    def session(self, start, hands, bankroll=None):
+        """Result, drawdown and ruin for one window of the stream
+
+        Args:
+            start:      Index of the session's first hand
+            hands:      Number of hands in the session
+            bankroll:   Session bankroll in units, ruin is not checked if None
+
+        Returns:
+            A tuple of (result, max drawdown, ruined)
+        """
+        curve = self._curve[start:start + hands + 1]
+        base = curve[0]
+        peaks = accumulate(curve, max)
+        drawdown = max(map(operator.sub, peaks, curve))
+        ruined = bankroll is not None and min(curve) - base <= -bankroll
+        return (curve[-1] - base, drawdown, ruined)
+
+    def simulate(self, sessions, hands, bankroll=None, seed=None):
+        """Simulates many sessions and summarizes them
+
+        Each session is a different one of the stream's len // hands
+        consecutive blocks of `hands` hands, chosen at random, so no hand
+        is played in two sessions.
+
+        Args:
+            sessions:   Number of sessions
+            hands:      Hands per session
+            bankroll:   Session bankroll in units used for risk of ruin
+            seed:       Seed for the choice of blocks
+
+        Returns:
+            A dict with the mean and standard deviation of session results,
+            the mean and worst drawdown, the risk of ruin and the 5th, 50th
+            and 95th result percentiles
+
+        Raises:
+            ValueError: If the stream holds fewer than sessions * hands hands
+        """
+        if sessions < 1 or hands < 1:
+            raise ValueError("Need at least one session of one hand")
+        if sessions * hands > len(self._wins):
+            raise ValueError(f"{sessions} sessions of {hands} hands need a "
+                             f"stream of {sessions * hands} hands, not "
+                             f"{len(self._wins)}")
+
+        rng = random.Random(seed)
+        blocks = rng.sample(range(len(self._wins) // hands), sessions)
+        starts = [block * hands for block in blocks]
+        results, drawdowns, ruins = zip(
+            *[self.session(start, hands, bankroll) for start in starts])
+
+        mean = math.fsum(results) / sessions
+        variance = math.fsum((r - mean) ** 2 for r in results) / sessions
+        ordered = sorted(results)
+        return {
+            'sessions': sessions,
+            'hands': hands,
+            'mean': mean,
+            'stdev': math.sqrt(variance),
+            'mean_drawdown': math.fsum(drawdowns) / sessions,
+            'max_drawdown': max(drawdowns),
+            'risk_of_ruin': sum(ruins) / sessions,
+            'p5': ordered[int(0.05 * (sessions - 1))],
+            'p50': ordered[int(0.50 * (sessions - 1))],
+            'p95': ordered[int(0.95 * (sessions - 1))]
+        }
@@ -0,0 +1,181 @@
+from blackjackgame import BlackjackGame, IllegalActionError
+from array import array
+import stateindex
+
+# Game methods in the order of stateindex.ACTIONS, so action ids index them
+ACTION_METHODS = (BlackjackGame.player_hit, BlackjackGame.player_stand,
+                  BlackjackGame.player_double, BlackjackGame.player_split,
+                  BlackjackGame.player_surrender)
+
+# Observation of a finished hand, one past the largest state index
+TERMINAL = stateindex.SIZE
+
+
+class BlackjackEnv:
+    """Step/reset environment over a BlackjackGame
+
+    Observations are the integer state indexes of stateindex and actions
+    are the integer ids of stateindex.ACTIONS, so the caller drives the
+    game directly instead of being called back by a BlackjackGameRunner.
+
+        env = BlackjackEnv()
+        observation = env.reset()
+        done = False
+        while not done:
+            observation, reward, done, info = env.step(policy(observation))
+
+    The reward is 0 until the hand, including every split hand, is over and
+    then the hand's net score. Naturals end a hand before any decision, so
+    reset settles them and deals again until a decision is needed; their
+    scores are reported in `natural_reward`.
+    """
+
+    def __init__(self, rules=None, rng=None):
+        """Creates the environment
+
+        Observations do not include the count, the state index has no room
+        for it.
+
+        Args:
+            rules:  The RuleSet to play by, the defaults if None
+            rng:    random.Random new shoes are shuffled with, the random
+                    module if None
+        """
+        self.game = BlackjackGame(extended=True, rules=rules, naturals=True,
+                                  rng=rng)
+        self._natural_reward = 0.0
+
+    @property
+    def natural_reward(self):
+        """Total score of the naturals settled by the last reset"""
+        return self._natural_reward
+
+    @property
+    def observation(self):
+        """State index of the hand being played, TERMINAL once it is over"""
+        game = self.game
+        return game.state_index if game.active else TERMINAL
+
+    def action_mask(self):
+        """Bit mask of the allowed action ids, bit i for ACTIONS[i]"""
+        mask = 0
+        for action in self.game.actions:
+            mask |= 1 << stateindex.ACTION_IDS[action]
+        return mask
+
+    def reset(self):
+        """Deals until a hand needs a decision
+
+        Returns:
+            The observation of the new hand
+        """
+        game = self.game
+        self._natural_reward = 0.0
+        game.deal()
+        while not game.active:
+            self._finish()
+            self._natural_reward += game.score
+            game.deal()
+        return game.state_index
+
+    def step(self, action):
+        """Takes an action in the current hand
+
+        Args:
+            action: Action id, see stateindex.ACTION_IDS
+
+        Returns:
+            A tuple of (observation, reward, done, info), info being a dict
+            with the outcome once the hand is over
+
+        Raises:
+            IllegalActionError: If the action is not allowed or not an
+                                action id, or the hand is over and reset
+                                has not been called
+        """
+        game = self.game
+        if not game.active:
+            raise IllegalActionError("The hand is over, call reset")
+        if not 0 <= action < len(ACTION_METHODS):
+            raise IllegalActionError(f"No action has the id {action}")
+        ACTION_METHODS[action](game)
+        if game.active:
+            return (game.state_index, 0.0, False, {})
+        self._finish()
+        return (TERMINAL, game.score, True, {'outcome': game.outcome_str()})
+
+    def _finish(self):
+        """Plays the dealer's hand if any player hand needs its total"""
+        game = self.game
+        if game.dealer_needed:
+            while game.dealer_must_hit:
+                game.dealer_hit()
+
+
+class VectorEnv:
+    """Steps K independent BlackjackEnvs at once
+
+    Actions, observations, rewards and done flags are arrays with one entry
+    per environment. A finished hand is reset straight away, so the
+    observation returned for it is that of the next hand and every entry
+    always needs an action; its reward is the finished hand's score.
+
+        envs = VectorEnv(64)
+        observations = envs.reset()
+        for _ in range(steps):
+            observations, rewards, dones, info = envs.step(
+                policy(observations, envs.action_masks()))
+    """
+
+    def __init__(self, k, rules=None, rng=None):
+        """Creates k environments
+
+        Args:
+            k:      Number of environments
+            rules:  The RuleSet to play by, the defaults if None
+            rng:    random.Random shared by the environments' shuffles,
+                    the random module if None
+        """
+        if k < 1:
+            raise ValueError("A vector needs at least one environment")
+        self.envs = [BlackjackEnv(rules, rng) for _ in range(k)]
+
+    def __len__(self):
+        """Number of environments"""
+        return len(self.envs)
+
+    def reset(self):
+        """Resets every environment and returns their observations"""
+        return array('q', [env.reset() for env in self.envs])
+
+    def action_masks(self):
+        """Array of the allowed action bit masks, see BlackjackEnv"""
+        return array('b', [env.action_mask() for env in self.envs])
+
+    def step(self, actions):
+        """Takes one action in every environment
+
+        Args:
+            actions: Sequence of action ids, one per environment
+
+        Returns:
+            A tuple of (observations, rewards, dones, info). info holds
+            'natural_rewards', the scores of naturals settled by the
+            automatic resets, which belong to no decision.
+        """
+        if len(actions) != len(self.envs):
+            raise ValueError("Expected one action per environment")
+        observations = array('q', bytes(8 * len(self.envs)))
+        rewards = array('d', bytes(8 * len(self.envs)))
+        dones = array('b', bytes(len(self.envs)))
+        naturals = array('d', bytes(8 * len(self.envs)))
+        for i, env in enumerate(self.envs):
+            observation, reward, done, _ = env.step(actions[i])
+            if done:
+                observation = env.reset()
+                naturals[i] = env.natural_reward
+                rewards[i] = reward
+                dones[i] = 1
+            observations[i] = observation
+        return (observations, rewards, dones,
+                {'natural_rewards': naturals})
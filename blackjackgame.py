@@ -1,13 +1,22 @@
 from deck import *
+from ruleset import RuleSet
+from array import array
+import stateindex
 
 
 class Hand:
     """A list of cards representing a single hand in blackjack"""
 
     def __init__(self, cards=[]):
-        """Initializes the cards list"""
+        """Initializes the cards list
+
+        The total is kept as a hard total and an Ace flag, updated as cards
+        are added, so reading it does not walk the cards.
+        """
         self._cards = cards
-        self._soft = False
+        self._hard = 0
+        self._ace = False
+        self._tally(cards)
 
     def __str__(self):
         """The string representation of the list and contained cards"""
@@ -37,13 +46,24 @@ class Hand:
         """
         if type(other) == list:
             self._cards = self._cards + other
+            self._tally(other)
         elif type(other) == Hand:
             self._cards = self._cards + other._cards
+            self._tally(other._cards)
         elif type(other) == Card:
             self._cards.append(other)
+            self._tally((other,))
         else:
             raise TypeError("Invalid type for <Hand> + <Type>")
 
+    def _tally(self, cards):
+        """Adds the values of newly added cards to the hard total"""
+        for card in cards:
+            value = card.value
+            self._hard += value
+            if value == 1:
+                self._ace = True
+
     @property
     def contains_ace(self):
         """Returns True if the hand contains an Ace"""
@@ -57,8 +77,7 @@ class Hand:
         """Checks the current total and returns True on soft totals
         A soft total is an Ace being counted as 11 but could count as 1
         """
-        self.total
-        return self._soft
+        return self._ace and self._hard <= 11
 
     @property
     def cards(self):
@@ -70,33 +89,125 @@ class Hand:
         """Returns the (Blackjack) total for the hand
         Aces are handled automatically
         """
-        total = 0
-        for card in self._cards:
-            total += card.value
-
-        if total <= 11 and self.contains_ace:
-            self._soft = True
-            return total + 10
-        else:
-            self._soft = False
-            return total
+        if self._ace and self._hard <= 11:
+            return self._hard + 10
+        return self._hard
 
     @property
     def bust(self):
         """True if the hand total is > 21"""
-        return self.total > 21
+        return self._hard > 21
+
+
+class GameSnapshot:
+    """The player's view of a hand in progress, as plain integers
+
+    Holds the current hand as a hard total and an ace flag, the dealer's
+    upcard value (Ace as 1) and the count of every card value the player
+    has not seen, the dealer's hole card included. No Card or Hand is
+    copied, so taking one costs about as much as reading the totals.
+
+    Only a single unsplit hand can be represented.
+    """
+
+    __slots__ = ('player_hard', 'player_ace', 'upcard', 'composition',
+                 'infinite', 'peeked', 'naturals', '_pool')
+
+    def __init__(self, player_hard, player_ace, upcard, composition,
+                 infinite=False, peeked=True, naturals=True):
+        """Creates a snapshot
+
+        Args:
+            player_hard:    Total of the player's hand counting Aces as 1
+            player_ace:     True if the player's hand holds an Ace
+            upcard:         Value of the dealer's upcard, Ace as 1
+            composition:    array of unseen cards per value, Ace first
+            infinite:       True if cards are drawn from an infinite deck,
+                            composition then only gives their proportions
+            peeked:         True if the dealer has checked for blackjack,
+                            which rules out some hole cards
+            naturals:       True if a dealer blackjack beats the player's
+                            21, False if it is a plain 21
+        """
+        self.player_hard = player_hard
+        self.player_ace = player_ace
+        self.upcard = upcard
+        self.composition = composition
+        self.infinite = infinite
+        self.peeked = peeked
+        self.naturals = naturals
+        self._pool = None
+
+    @property
+    def player_soft(self):
+        """True if the player's Ace is counted as 11"""
+        return self.player_ace and self.player_hard <= 11
+
+    @property
+    def player_total(self):
+        """The player's blackjack total"""
+        return self.player_hard + 10 if self.player_soft else self.player_hard
+
+    @property
+    def pool(self):
+        """array of the value of every unseen card, in no particular order
+
+        Built from the composition on first use and kept, so the
+        composition should not change afterwards. Users may permute it but
+        must put it back as they found it.
+        """
+        if self._pool is None:
+            pool = array('b')
+            for value, count in enumerate(self.composition, 1):
+                pool.extend(array('b', [value]) * count)
+            self._pool = pool
+        return self._pool
+
+    def copy(self):
+        """Returns an independent snapshot, copying only the composition"""
+        return GameSnapshot(self.player_hard, self.player_ace, self.upcard,
+                            array('l', self.composition), self.infinite,
+                            self.peeked, self.naturals)
 
 
 class BlackjackGame:
 
-    def __init__(self):
-        """Creates a game with a deck, one player, and dealer"""
-        self._deck = Deck()
-        self._deck.shuffle()
+    def __init__(self, track_count=False, tags=HI_LO, extended=False,
+                 rules=None, naturals=False, rng=None):
+        """Creates a game with a deck, one player, and dealer
+
+        Args:
+            track_count:    When True the running and true count are
+                            included in state() and the true count is
+                            appended to prevstate keys, eg: 'H13-9@+2'
+            tags:           Tag system used for the count, see TAG_SYSTEMS
+            extended:       When True active states include the allowed
+                            'actions' and the extended 'state_index', and
+                            decisions are recorded with their index
+            rules:          The RuleSet to play by, the defaults if None
+            naturals:       When True a player blackjack is paid the rules'
+                            payout and ends the hand on the deal, as does a
+                            dealer blackjack when the dealer peeks. When
+                            False a natural is a plain 21 and every hand is
+                            played out.
+            rng:            random.Random new shoes are shuffled with, the
+                            random module if None
+        """
+        self._rules = rules if rules is not None else RuleSet()
+        self._naturals = naturals
+        self._rng = rng
+        self._track_count = track_count
+        self._tags = tags
+        self._extended = extended
+        self._deck = self._new_deck()
+        self._deal_count = 0
         self._dealer = Hand()
-        self._player = Hand()
-        self._player_standing = False
-        self._prevstate = None
+        self._start_hand([])
+
+    @property
+    def rules(self):
+        """Readonly access to the RuleSet"""
+        return self._rules
 
     @property
     def dealer(self):
@@ -105,9 +216,127 @@ class BlackjackGame:
 
     @property
     def player(self):
-        """Readonly access to the player's hand"""
+        """Readonly access to the player's current hand
+
+        After a split this is the hand currently being played, see `hands`
+        """
         return self._player
 
+    @property
+    def hands(self):
+        """Readonly access to all of the player's hands, one unless split"""
+        return self._hands
+
+    @property
+    def bets(self):
+        """Bet on each of the player's hands, 2 for doubled hands"""
+        return self._bets
+
+    @property
+    def surrendered(self):
+        """True if the player surrendered the current hand"""
+        return self._surrendered
+
+    @property
+    def pair(self):
+        """Value of the player's pair, 0 when the hand is not a pair"""
+        cards = self.player.cards
+        if len(cards) == 2 and cards[0].value == cards[1].value:
+            return cards[0].value
+        return 0
+
+    def _options(self):
+        """Returns (can_double, can_split, can_surrender) in one pass"""
+        if not self.active:
+            return (False, False, False)
+        rules = self._rules
+        two_cards = len(self._player) == 2
+        split = len(self._hands) > 1
+        return (two_cards and (rules.double_after_split or not split),
+                self.pair != 0 and len(self._hands) < rules.max_split_hands,
+                rules.surrender and two_cards and not split
+                and self._prevstate is None)
+
+    @property
+    def can_double(self):
+        """True if the current hand may double down"""
+        return self._options()[0]
+
+    @property
+    def can_split(self):
+        """True if the current hand is a pair and may be split"""
+        return self._options()[1]
+
+    @property
+    def can_surrender(self):
+        """True if the player may still surrender, ie: before any action"""
+        return self._options()[2]
+
+    def _extended_state(self):
+        """Returns (allowed actions, state index) in one pass"""
+        can_double, can_split, can_surrender = self._options()
+        index = stateindex.encode(self.player_total, self._player.soft,
+                                  self.dealer_upcard, self.pair,
+                                  can_double, can_split)
+
+        if not self.active:
+            return ([], index)
+        actions = ['hit', 'stand']
+        if can_double:
+            actions.append('double')
+        if can_split:
+            actions.append('split')
+        if can_surrender:
+            actions.append('surrender')
+        return (actions, index)
+
+    @property
+    def actions(self):
+        """List of the actions currently allowed"""
+        return self._extended_state()[0]
+
+    @property
+    def state_index(self):
+        """Dense integer index of the current extended state
+
+        See stateindex.encode
+        """
+        return self._extended_state()[1]
+
+    @property
+    def player_blackjack(self):
+        """True if the player was dealt a natural 21, not after a split
+
+        Always False unless the game settles naturals
+        """
+        return (self._naturals and len(self._hands) == 1
+                and len(self._player) == 2 and self.player_total == 21)
+
+    @property
+    def dealer_blackjack(self):
+        """True if the dealer has a natural 21
+
+        Always False unless the game settles naturals
+        """
+        return (self._naturals and len(self.dealer) == 2
+                and self.dealer_total == 21)
+
+    @property
+    def dealer_must_hit(self):
+        """True while the dealer has to draw under the rules"""
+        return self._rules.dealer_must_hit(self.dealer_total,
+                                           self.dealer.soft)
+
+    @property
+    def dealer_needed(self):
+        """True if any hand is still waiting on the dealer's total"""
+        if self._surrendered or self.player_blackjack:
+            return False
+        for hand in self._hands:
+            if not hand.bust:
+                return True
+        return False
+
     @property
     def active(self):
         """Returns True if the player can still choose to Hit"""
@@ -147,10 +376,93 @@ class BlackjackGame:
         """True if the dealer has busted"""
         return self.dealer.bust
 
+    @property
+    def extended(self):
+        """True if states include the extended state index and actions"""
+        return self._extended
+
+    @property
+    def naturals(self):
+        """True if blackjacks are settled on the deal"""
+        return self._naturals
+
+    @property
+    def track_count(self):
+        """True if the count is included in states and prevstate keys"""
+        return self._track_count
+
+    @property
+    def _hole_hidden(self):
+        """True while the dealer's hole card is drawn but not yet seen"""
+        return (self.active and len(self._dealer) > 1
+                and not self._rules.infinite)
+
+    @property
+    def running_count(self):
+        """Running count of the cards the player has seen
+
+        The dealer's hole card is drawn from the deck on the deal but only
+        counted once the player's turn is over and it is turned up.
+        """
+        count = self._deck.running_count
+        if self._hole_hidden:
+            count -= self._tags[self._dealer.cards[1].value]
+        return count
+
+    @property
+    def true_count(self):
+        """True count the player can see, truncated towards zero
+
+        Until it is turned up, the hole card counts as one of the cards
+        remaining.
+        """
+        if not self._hole_hidden:
+            return int(self._deck.true_count)
+        return int(self.running_count / ((len(self._deck) + 1) / 52))
+
+    @property
+    def deal_true_count(self):
+        """True count when the current hand was dealt, eg: to size its bet"""
+        return self._deal_count
+
     @property
     def prevstate(self):
         return self._prevstate
 
+    @property
+    def prevstate_index(self):
+        """(state index, action id) of the previous decision
+
+        None on new hands, and always None unless the game is extended
+        """
+        return self._previndex
+
+    def snapshot(self):
+        """Returns a GameSnapshot of the current hand for planning
+
+        The composition is that of the deck with the dealer's hole card
+        put back, since the player has not seen it.
+
+        Raises:
+            IllegalActionError: When the player has split, a snapshot only
+                                holds a single hand
+        """
+        if len(self._hands) > 1:
+            raise IllegalActionError("Cannot snapshot split hands")
+        hard = 0
+        ace = False
+        for card in self._player.cards:
+            hard += card.value
+            ace = ace or card.value == 1
+        composition = array('l', self._deck.composition)
+        infinite = self._rules.infinite
+        if not infinite and len(self._dealer) > 1:
+            composition[self._dealer.cards[1].value - 1] += 1
+        return GameSnapshot(hard, ace, self._dealer.cards[0].value,
+                            composition, infinite,
+                            self._naturals and self._rules.dealer_peek,
+                            self._naturals)
+
     def prevstate_tup(self, action):
         """Returns a string summarizing the previous state
         The information is from the player's perspective so includes only the
@@ -164,16 +476,79 @@ class BlackjackGame:
 
         EG: 'S17-8 Hit'-- Player had a soft 17, dealer upcard was 8,
             player chose to hit
+
+        When the game tracks the count the true count is appended to the
+        key, eg: 'S17-8@-1'
         """
         soft = 'S' if self.player.soft else 'H'
-        return (f"{soft}{self.player_total}-{self.dealer_upcard}", action)
+        key = f"{soft}{self.player_total}-{self.dealer_upcard}"
+        if self._track_count:
+            key = f"{key}@{self.true_count:+d}"
+        return (key, action)
 
     def deal(self):
-        """Removes old hands and deals new ones"""
+        """Removes old hands and deals new ones
+
+        The shoe is replaced first once it has been dealt past the rules'
+        penetration. When the game settles naturals, a hand dealt a player
+        blackjack, or a dealer blackjack when the dealer peeks, is over
+        before the player acts.
+        """
+        if self._rules.needs_shuffle(self._deck):
+            self._deck = self._new_deck()
+        self._deal_count = self.true_count
+        self._dealer = Hand(self.safe_draw(2))
+        self._start_hand(self.safe_draw(2))
+
+    def _start_hand(self, cards):
+        """Resets the player's hands to a single new hand of cards"""
         self._prevstate = None
+        self._previndex = None
         self._player_standing = False
-        self._dealer = Hand(self.safe_draw(2))
-        self._player = Hand(self.safe_draw(2))
+        self._surrendered = False
+        self._player = Hand(cards)
+        self._hands = [self._player]
+        self._bets = [1]
+        self._current = 0
+        # Last (prevstate, prevstate_index) for each hand and (prevstate,
+        # prevstate_index, hand indices) for each split, only kept once
+        # the player splits. Until then _prevstate is the only decision.
+        self._decisions = None
+        self._splits = None
+
+        if cards and (self.player_blackjack or (
+                self._rules.dealer_peek and self.dealer_blackjack)):
+            self._player_standing = True
+
+    def _record(self, action):
+        """Records action as the previous decision of the current hand"""
+        previndex = None
+        if self._extended:
+            previndex = (self.state_index, stateindex.ACTION_IDS[action])
+        self._prevstate = self.prevstate_tup(action)
+        self._previndex = previndex
+        if self._splits is not None:
+            self._decisions[self._current] = (self._prevstate, previndex)
+
+    def _next_hand(self):
+        """Moves on from a finished hand
+
+        Play continues with the next split hand if there is one, otherwise
+        the player is standing unless the last hand busted. The previous
+        decision is cleared when switching hands since it belonged to the
+        finished hand, whose result is reported through results().
+        """
+        if self._current + 1 < len(self._hands):
+            self._current += 1
+            self._player = self._hands[self._current]
+            self._prevstate = None
+            self._previndex = None
+        elif not self.player_bust:
+            self._player_standing = True
+
+    def _new_deck(self):
+        """Creates and shuffles a new deck"""
+        return self._rules.new_deck(self._tags, self._rng)
 
     def safe_draw(self, n):
         """Draws cards without raising an EmptyDeckError
@@ -191,15 +566,16 @@ class BlackjackGame:
         try:
             cards = self._deck.draw(n)
         except EmptyDeckError:
-            self._deck = Deck()
-            self._deck.shuffle()
+            self._deck = self._new_deck()
             cards = self._deck.draw(n)
         return cards
 
     def player_hit(self):
         """Adds one card to the players hand from the top of the deck"""
-        self._prevstate = self.prevstate_tup('hit')
+        self._record('hit')
         self.player + self.safe_draw(1)
+        if self.player_bust:
+            self._next_hand()
 
     def dealer_hit(self):
         """Adds one card to the dealer's hand from the top of the deck"""
@@ -207,12 +583,131 @@ class BlackjackGame:
 
     def player_stand(self):
         """Action method used when the player chooses to stand"""
-        self._prevstate = self.prevstate_tup('stand')
+        self._record('stand')
+        self._next_hand()
+
+    def player_double(self):
+        """Doubles the bet, draws exactly one card and ends the hand
+
+        Raises:
+            IllegalActionError: When the hand cannot double
+        """
+        if not self.can_double:
+            raise IllegalActionError("Can only double on two cards")
+        self._record('double')
+        self._bets[self._current] *= 2
+        self.player + self.safe_draw(1)
+        self._next_hand()
+
+    def player_split(self):
+        """Splits a pair into two hands with one new card each
+
+        Each new hand carries the original bet. Split aces receive just
+        the one card and are not played further.
+
+        Raises:
+            IllegalActionError: When the hand is not a splittable pair
+        """
+        if not self.can_split:
+            raise IllegalActionError("Can only split pairs")
+        self._record('split')
+        first, second = self.player.cards
+        index = self._current
+        if self._splits is None:
+            self._decisions = [None]
+            self._splits = []
+
+        self._hands[index] = Hand([first] + self.safe_draw(1))
+        self._hands.insert(index + 1, Hand([second] + self.safe_draw(1)))
+        self._bets.insert(index + 1, self._bets[index])
+        self._decisions[index] = None
+        self._decisions.insert(index + 1, None)
+
+        for split in self._splits:
+            split[2][:] = [i + 1 if i > index else i for i in split[2]]
+            if index in split[2]:
+                split[2].append(index + 1)
+        self._splits.append((self._prevstate, self._previndex,
+                             [index, index + 1]))
+
+        self._player = self._hands[index]
+        self._prevstate = None
+        self._previndex = None
+        if first.value == 1:
+            self._current += 1
+            self._player = self._hands[self._current]
+            self._next_hand()
+
+    def player_surrender(self):
+        """Gives up the hand for the loss of half the bet
+
+        Raises:
+            IllegalActionError: When it is too late to surrender
+        """
+        if not self.can_surrender:
+            raise IllegalActionError("Can only surrender as a first action")
+        self._record('surrender')
+        self._surrendered = True
         self._player_standing = True
 
+    def hand_score(self, index):
+        """Net result of one of the player's hands, in units of the bet"""
+        if self._surrendered:
+            return -0.5
+        if self.player_blackjack:
+            return 0 if self.dealer_blackjack else self._rules.blackjack_payout
+
+        bet = self._bets[index]
+        total = self._hands[index].total
+        if self.dealer_blackjack or total > 21:
+            return -bet
+        elif self.dealer_bust or total > self.dealer_total:
+            return bet
+        elif total == self.dealer_total:
+            return 0
+        else:
+            return -bet
+
+    @property
+    def score(self):
+        """Net result of all of the player's hands"""
+        return sum(self.hand_score(i) for i in range(len(self._hands)))
+
+    def results(self):
+        """Credits each decision with the result it led to
+
+        Returns a list of (prevstate, prevstate_index, score) tuples: one
+        per hand for its last decision, plus one per split for the total of
+        every hand that came from it.
+        """
+        if self._splits is None:
+            if self._prevstate is None:
+                return []
+            return [(self._prevstate, self._previndex, self.hand_score(0))]
+
+        scores = [self.hand_score(i) for i in range(len(self._hands))]
+        results = []
+        for i, decision in enumerate(self._decisions):
+            if decision is not None:
+                results.append((decision[0], decision[1], scores[i]))
+        for prevstate, previndex, hands in self._splits:
+            results.append((prevstate, previndex,
+                            sum(scores[i] for i in hands)))
+        return results
+
     def outcome_str(self):
-        """Returns a string describing the outcome ['Win'|'Loss'|'Push']"""
-        if not self.player_bust and self.player_total > self.dealer_total:
+        """Returns a string describing the outcome ['Win'|'Loss'|'Push']
+
+        After a split this describes the last hand, and a surrendered
+        hand is a 'Loss'.
+        """
+        if self._surrendered:
+            return "Loss"
+        elif self.player_blackjack or self.dealer_blackjack:
+            if self.player_blackjack and self.dealer_blackjack:
+                return "Push"
+            return "Win" if self.player_blackjack else "Loss"
+        elif not self.player_bust and self.player_total > self.dealer_total:
             return "Win"
         elif not self.player_bust and self.dealer_bust:
             return "Win"
@@ -229,12 +724,18 @@ class BlackjackGame:
         """
         outcome = self.outcome_str()
         if outcome == 'Win':
-            if self.dealer_bust:
+            if self.player_blackjack:
+                return 'Blackjack'
+            elif self.dealer_bust:
                 return 'Dealer busted'
             else:
                 return 'Player won'
         elif outcome == 'Loss':
-            if self.player_bust:
+            if self._surrendered:
+                return 'Player surrendered'
+            elif self.dealer_blackjack:
+                return 'Dealer blackjack'
+            elif self.player_bust:
                 return 'Player busted'
             else:
                 return 'Dealer won'
@@ -249,6 +750,16 @@ class BlackjackGame:
         the player has either busted or chosen to stand. When called on a
         'not active' game it returns the outcome (Win|Push|Loss) as well as a
         more detailed description of the outcome (eg: 'Player busted')
+
+        Extended games also report the net 'score' over all split hands and
+        the per-decision 'results' of finished hands, and list the allowed
+        'actions' of active states along with the 'state_index' and
+        'prevstate_index'. Other games can read them from `score` and
+        results().
+
+        Games tracking the count also include 'running_count',
+        'true_count' and the 'deal_true_count' the hand started with in
+        both cases.
         """
         state = {}
 
@@ -259,6 +770,10 @@ class BlackjackGame:
             state['player_soft'] = self.player.soft
             state['dealer_soft'] = self.dealer.soft
             state['prevstate'] = self.prevstate
+            if self._extended:
+                state['prevstate_index'] = self.prevstate_index
+                state['actions'], state['state_index'] = \
+                    self._extended_state()
         else:
             state["active"] = False
             state["player_total"] = self.player_total
@@ -269,5 +784,18 @@ class BlackjackGame:
 
             state["outcome"] = self.outcome_str()
             state["description"] = self.outcome_descr()
+            if self._extended:
+                state['score'] = self.score
+                state['results'] = self.results()
+
+        if self._track_count:
+            state['running_count'] = self.running_count
+            state['true_count'] = self.true_count
+            state['deal_true_count'] = self.deal_true_count
 
         return state
+
+
+class IllegalActionError(Exception):
+    """Raised when an action is not allowed in the current game state"""
+    pass
@@ -1,11 +1,16 @@
-from blackjackgame import BlackjackGame
+from blackjackgame import BlackjackGame, IllegalActionError
+from blackjacktable import BlackjackTable
 
 
 class BlackjackGameRunner:
 
-    def __init__(self):
-        """Creates a game runner object"""
-        self.game = BlackjackGame()
+    def __init__(self, game=None):
+        """Creates a game runner object
+
+        Args:
+            game: The BlackjackGame to run, a default game is created if None
+        """
+        self.game = game if game is not None else BlackjackGame()
 
     def run(self, responder, n=-1):
         """Runs the game using the responder function as the 'Player'
@@ -22,44 +27,121 @@ class BlackjackGameRunner:
             When game is active:
                 - 'Hit': If player busts the game switches to not active
                 - 'Stand':  Game switches to not active, dealer hits until it
-                            reaches 17 or more and then returns the outcome
-                            of the hand.
+                            reaches 17 or more (hitting soft 17 under H17
+                            rules) and then returns the outcome of the hand.
+                - 'Double': Doubles the bet and draws one final card
+                - 'Split':  Splits a pair, each hand is then played in turn
+                - 'Surrender':  Gives up half the bet, only allowed as the
+                                first action of a hand
             When game is not active (player has busted or stood):
                 - 'Deal': Deals another hand, game switches to active
                 - 'End': Ends the game without another hand. Method returns
 
         Raises:
             InvalidActionError: When an improper response is given
+            IllegalActionError: When an action is not allowed, eg: splitting
+                                a hand that is not a pair
         """
         while n != 0:
             self.game.deal()
-
-            while self.game.active:
-                # Deal with hitting until bust or stand
-                response = responder(self.game.state())
-
-                if response == "hit":
-                    self.game.player_hit()
-                elif response == "stand":
-                    self.game.player_stand()
-                else:
-                    raise InvalidActionError(
-                        "Valid actions are 'Hit' or 'Stand'")
+            self.play_player(self.game, responder)
 
             # Deal with end of hand stuff, print totals, etc.
-            if self.game.player_bust:
-                response = responder(self.game.state())
-            else:
-                while self.game.dealer_total < 17:
-                    self.game.dealer_hit()
+            if self.game.dealer_needed:
+                self.play_dealer(self.game)
 
-                response = responder(self.game.state())
+            response = responder(self.game.state())
 
             if response == 'end':
                 return None
 
             n -= 1
 
+    def play_player(self, game, responder):
+        """Asks the responder for actions until the player's hands are over
+
+        Raises:
+            InvalidActionError: When an improper response is given
+            IllegalActionError: When an action is not allowed
+        """
+        while game.active:
+            # Deal with hitting until bust or stand
+            response = responder(game.state())
+
+            if response == "hit":
+                game.player_hit()
+            elif response == "stand":
+                game.player_stand()
+            elif response == "double":
+                game.player_double()
+            elif response == "split":
+                game.player_split()
+            elif response == "surrender":
+                game.player_surrender()
+            else:
+                raise InvalidActionError(
+                    "Valid actions are 'Hit', 'Stand', 'Double', 'Split' "
+                    "or 'Surrender'")
+
+    def play_dealer(self, game):
+        """Draws dealer cards until the rules let the dealer stand"""
+        while game.dealer_must_hit:
+            game.dealer_hit()
+
+
+class BlackjackTableRunner(BlackjackGameRunner):
+
+    def __init__(self, seats=2, **options):
+        """Creates a runner for a table with several player seats
+
+        Args:
+            seats:      Number of player seats sharing the deck
+            options:    Keyword arguments for the BlackjackGame of every
+                        seat, eg: track_count=True
+        """
+        self.game = BlackjackTable(seats, **options)
+
+    def run(self, responders, n=-1):
+        """Runs rounds of play with one responder per seat
+
+        Every seat plays its hand in turn, then the dealer's hand is played
+        out once and each seat is sent its final state. Responses are the
+        same as for BlackjackGameRunner.run; an 'End' from any seat ends the
+        game after the current round.
+
+        Args:
+            responders: A list with one responder function per seat, or a
+                        single responder used for every seat
+            n:          Number of rounds, for an infinite number of rounds
+                        use any negative integer. Each round plays one hand
+                        per seat.
+
+        Raises:
+            InvalidActionError: When an improper response is given
+        """
+        if callable(responders):
+            responders = [responders] * len(self.game)
+        if len(responders) != len(self.game):
+            raise ValueError("Expected one responder per seat")
+
+        seats = list(zip(self.game.seats, responders))
+        while n != 0:
+            self.game.deal()
+            for seat, responder in seats:
+                self.play_player(seat, responder)
+
+            if self.game.dealer_needed:
+                self.play_dealer(self.game)
+
+            ended = False
+            for seat, responder in seats:
+                if responder(seat.state()) == 'end':
+                    ended = True
+
+            if ended:
+                return None
+
+            n -= 1
 
 
 class InvalidActionError(Exception):
@@ -0,0 +1,170 @@
+from blackjackgame import *
+
+
+class TableSeat(BlackjackGame):
+    """A single player's game at a BlackjackTable
+
+    The seat behaves exactly like a BlackjackGame, so it produces the same
+    state dicts and prevstate keys, but the deck and the dealer's hand belong
+    to the table and are shared with every other seat.
+    """
+
+    def __init__(self, table, **options):
+        """Creates a seat at table
+
+        The seat's deck and dealer's hand are always the table's, so the
+        game's own attempts to replace them are ignored.
+
+        Args:
+            table:      The BlackjackTable the seat belongs to
+            options:    Keyword arguments for BlackjackGame
+        """
+        self._table = table
+        super().__init__(**options)
+
+    @property
+    def _deck(self):
+        return self._table.deck
+
+    @_deck.setter
+    def _deck(self, deck):
+        # The table replaces its own deck, see BlackjackTable.safe_draw
+        pass
+
+    @property
+    def _dealer(self):
+        return self._table.dealer
+
+    @_dealer.setter
+    def _dealer(self, hand):
+        # The table deals its own dealer hand, see BlackjackTable.deal
+        pass
+
+    def _new_deck(self):
+        """Seats never create decks of their own"""
+        return self._table.deck
+
+    def safe_draw(self, n):
+        """Draws from the table's shared deck"""
+        return self._table.safe_draw(n)
+
+    def deal(self):
+        """Seats are dealt by the table, see BlackjackTable.deal"""
+        raise TableDealError("Deal the whole table with BlackjackTable.deal")
+
+    def seat_cards(self, cards, deal_count=0):
+        """Starts a new hand for this seat with the given cards
+
+        Args:
+            cards:      The seat's two cards
+            deal_count: True count when the round was dealt, see
+                        BlackjackGame.deal_true_count
+        """
+        self._deal_count = deal_count
+        self._start_hand(cards)
+
+
+class BlackjackTable:
+
+    def __init__(self, seats=2, **options):
+        """Creates a table of player seats sharing one deck and dealer
+
+        Args:
+            seats:      Number of player seats
+            options:    Keyword arguments for the BlackjackGame of every
+                        seat, eg: track_count=True
+        """
+        if seats < 1:
+            raise ValueError("A table needs at least one seat")
+        if options.get('rules') is None:
+            options['rules'] = RuleSet()
+        self._rules = options['rules']
+        self._tags = options.get('tags', HI_LO)
+        self._rng = options.get('rng')
+        self._deck = self._new_deck()
+        self._dealer = Hand()
+        self._seats = [TableSeat(self, **options) for _ in range(seats)]
+
+    def __len__(self):
+        """Number of seats"""
+        return len(self._seats)
+
+    @property
+    def seats(self):
+        """Readonly access to the list of seats"""
+        return self._seats
+
+    @property
+    def rules(self):
+        """Readonly access to the RuleSet shared by every seat"""
+        return self._rules
+
+    @property
+    def deck(self):
+        """Readonly access to the deck shared by every seat"""
+        return self._deck
+
+    @property
+    def dealer(self):
+        """Readonly access to the dealer's hand"""
+        return self._dealer
+
+    @property
+    def dealer_total(self):
+        """Returns the dealer's total hand value"""
+        return self.dealer.total
+
+    @property
+    def dealer_must_hit(self):
+        """True while the dealer has to draw under the rules"""
+        return self._rules.dealer_must_hit(self.dealer_total,
+                                           self.dealer.soft)
+
+    @property
+    def dealer_needed(self):
+        """True if at least one seat is still waiting on the dealer"""
+        for seat in self._seats:
+            if seat.dealer_needed:
+                return True
+        return False
+
+    def _new_deck(self):
+        """Creates and shuffles a new deck"""
+        return self._rules.new_deck(self._tags, self._rng)
+
+    def safe_draw(self, n):
+        """Draws cards, replacing an exhausted deck with a new one
+
+        See BlackjackGame.safe_draw
+        """
+        try:
+            return self._deck.draw(n)
+        except EmptyDeckError:
+            self._deck = self._new_deck()
+            return self._deck.draw(n)
+
+    def deal(self):
+        """Deals a new round in casino order
+
+        One card to each seat, then the dealer's upcard, then a second card
+        to each seat and finally the dealer's hole card. The shoe is
+        replaced first once it has been dealt past the penetration.
+        """
+        if self._rules.needs_shuffle(self._deck):
+            self._deck = self._new_deck()
+        count = int(self._deck.true_count)
+        first = [self.safe_draw(1) for _ in self._seats]
+        upcard = self.safe_draw(1)
+        second = [self.safe_draw(1) for _ in self._seats]
+        self._dealer = Hand(upcard + self.safe_draw(1))
+        for seat, one, two in zip(self._seats, first, second):
+            seat.seat_cards(one + two, count)
+
+    def dealer_hit(self):
+        """Adds one card to the dealer's hand"""
+        self.dealer + self.safe_draw(1)
+
+
+class TableDealError(Exception):
+    """Raised when a single seat is dealt outside of its table"""
+    pass
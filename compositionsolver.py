@@ -0,0 +1,312 @@
+from blackjackgame import BlackjackGame
+from blackjackgamerunner import BlackjackGameRunner
+from ruleset import RuleSet
+from collections import OrderedDict
+
+
+def composition(cards):
+    """Returns the canonical composition vector for a collection of cards
+
+    The vector is a tuple of ten counts, one per blackjack value, ordered
+    Ace (index 0) through ten-valued cards (index 9). Two collections holding
+    the same ranks in any order share the same vector.
+
+    Args:
+        cards: Any iterable of Card objects
+    """
+    counts = [0] * 10
+    for card in cards:
+        counts[card.value - 1] += 1
+    return tuple(counts)
+
+
+class EVCache:
+    """A size-bounded, least-recently-used cache of expected values
+
+    Keys are built from a shoe composition vector, the player's state and the
+    dealer's upcard (see `EVCache.key`). Once `maxsize` entries are held the
+    least recently used entry is evicted on every insert.
+    """
+
+    def __init__(self, maxsize=100000):
+        """Creates an empty cache
+
+        Args:
+            maxsize: Maximum number of entries held before evicting
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        """Number of entries currently cached"""
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Membership test that does not affect hit/miss statistics"""
+        return key in self._entries
+
+    @staticmethod
+    def key(comp, player_state, upcard):
+        """Builds a cache key
+
+        Args:
+            comp:           Composition vector, as returned by `composition`
+            player_state:   Any hashable summary of the player's hand
+            upcard:         The dealer's upcard value
+        """
+        return (comp, player_state, upcard)
+
+    @property
+    def maxsize(self):
+        """Maximum number of entries held"""
+        return self._maxsize
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default on a miss"""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self._misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used entry if full"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def clear(self):
+        """Removes all entries and resets the statistics"""
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def stats(self):
+        """Returns a dict of hit/miss statistics"""
+        lookups = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'size': len(self._entries),
+            'maxsize': self._maxsize,
+            'hit_rate': self._hits / lookups if lookups else 0.0
+        }
+
+
+class CompositionSolver:
+    """Exact hit/stand expected values for a known shoe composition
+
+    Every intermediate result (dealer outcome distributions as well as player
+    hit values) is memoized in an `EVCache`, so repeated decisions against
+    similar compositions reuse most of the work while memory stays bounded.
+    Cache keys include the rule set's key, so solvers for different rules
+    can share one cache. The dealer's draw-out follows the rules' soft 17
+    rule; blackjacks and peeking are not taken into account.
+    """
+
+    # Dealer final totals tracked, in order: 17, 18, 19, 20, 21, bust
+    OUTCOMES = (17, 18, 19, 20, 21, 22)
+
+    def __init__(self, cache=None, rules=None):
+        """Creates a solver
+
+        Args:
+            cache: An EVCache to memoize results in, a new one by default
+            rules: The RuleSet to solve for, the defaults if None
+        """
+        self.cache = cache if cache is not None else EVCache()
+        self.rules = rules if rules is not None else RuleSet()
+
+    @staticmethod
+    def _total(hard, ace):
+        """Blackjack total for a hard sum, counting one ace as 11 if it fits"""
+        if ace and hard <= 11:
+            return hard + 10
+        return hard
+
+    def dealer_probabilities(self, upcard, comp):
+        """Distribution of the dealer's final total
+
+        Args:
+            upcard: Dealer upcard value (1 or 11 for an Ace)
+            comp:   Composition the hole card and hits are drawn from
+
+        Returns:
+            A tuple of probabilities aligned with `CompositionSolver.OUTCOMES`
+        """
+        value = 1 if upcard == 11 else upcard
+        return self._dealer(value, value == 1, comp)
+
+    def _dealer(self, hard, ace, comp):
+        """Recursive dealer draw-out"""
+        key = EVCache.key(comp, ('dealer', hard, ace, self.rules.key), 0)
+        probs = self.cache.get(key)
+        if probs is not None:
+            return probs
+
+        remaining = sum(comp)
+        probs = [0.0] * 6
+        for index, count in enumerate(comp):
+            if count == 0:
+                continue
+            p = count / remaining
+            value = index + 1
+            new_hard = hard + value
+            new_ace = ace or value == 1
+            total = self._total(new_hard, new_ace)
+
+            if total > 21:
+                probs[5] += p
+            elif not self.rules.dealer_must_hit(total, total != new_hard):
+                probs[total - 17] += p
+            else:
+                reduced = comp[:index] + (count - 1,) + comp[index + 1:]
+                sub = self._dealer(new_hard, new_ace, reduced)
+                for i in range(6):
+                    probs[i] += p * sub[i]
+
+        probs = tuple(probs)
+        self.cache.put(key, probs)
+        return probs
+
+    def stand_ev(self, total, upcard, comp):
+        """Expected value of standing on `total`"""
+        probs = self.dealer_probabilities(upcard, comp)
+        ev = probs[5]
+        for i, dealer_total in enumerate(CompositionSolver.OUTCOMES[:5]):
+            if total > dealer_total:
+                ev += probs[i]
+            elif total < dealer_total:
+                ev -= probs[i]
+        return ev
+
+    def hit_ev(self, total, soft, upcard, comp):
+        """Expected value of hitting once and then playing optimally"""
+        hard = total - 10 if soft else total
+        return self._hit(hard, soft, upcard, comp)
+
+    def _hit(self, hard, ace, upcard, comp):
+        """Recursive player hit value"""
+        key = EVCache.key(comp, ('hit', hard, ace, self.rules.key), upcard)
+        ev = self.cache.get(key)
+        if ev is not None:
+            return ev
+
+        remaining = sum(comp)
+        ev = 0.0
+        for index, count in enumerate(comp):
+            if count == 0:
+                continue
+            p = count / remaining
+            value = index + 1
+            new_hard = hard + value
+            new_ace = ace or value == 1
+            total = self._total(new_hard, new_ace)
+
+            if total > 21:
+                ev -= p
+            else:
+                reduced = comp[:index] + (count - 1,) + comp[index + 1:]
+                ev += p * max(self.stand_ev(total, upcard, reduced),
+                              self._hit(new_hard, new_ace, upcard, reduced))
+
+        self.cache.put(key, ev)
+        return ev
+
+    def best_action(self, total, soft, upcard, comp):
+        """Returns a tuple of the best action ('hit'|'stand') and its EV"""
+        stand = self.stand_ev(total, upcard, comp)
+        if total >= 21:
+            return ('stand', stand)
+
+        hit = self.hit_ev(total, soft, upcard, comp)
+        if hit > stand:
+            return ('hit', hit)
+        else:
+            return ('stand', stand)
+
+    def prior(self, upcards=range(2, 12)):
+        """Full-shoe hit and stand EVs of every key, for warm starts
+
+        The shoe is that of the rules with only the upcard removed, the
+        player's cards being unknown for a key. An infinite deck is given
+        the composition of a single deck. Solving every upcard takes
+        seconds, several decks longer than one.
+
+        Args:
+            upcards:    Dealer upcards (2 to 11) to include keys for
+
+        Returns:
+            A dict of {key: {'hit': ev, 'stand': ev}}, see
+            ReinforcementLearner.warm_start
+        """
+        shoe = [4 * max(self.rules.decks, 1)] * 9 + \
+            [16 * max(self.rules.decks, 1)]
+        prior = {}
+        # One upcard at a time, high totals first, so that the hit values
+        # of low totals find the ones they recurse into still cached
+        for upcard in upcards:
+            comp = list(shoe)
+            comp[(1 if upcard == 11 else upcard) - 1] -= 1
+            comp = tuple(comp)
+            for soft, low in ((True, 12), (False, 4)):
+                for total in range(21, low - 1, -1):
+                    key = f"{'S' if soft else 'H'}{total}-{upcard}"
+                    prior[key] = {
+                        'hit': self.hit_ev(total, soft, upcard, comp),
+                        'stand': self.stand_ev(total, upcard, comp)
+                    }
+        return prior
+
+
+class CompositionPlayer:
+
+    def __init__(self, cache=None, rules=None):
+        """Creates a game runner and a composition-aware solver
+
+        Args:
+            cache: An EVCache shared with the solver, a new one by default
+            rules: The RuleSet to play by, the defaults if None
+        """
+        self.game = BlackjackGameRunner(
+            BlackjackGame(rules=rules, naturals=True))
+        self.solver = CompositionSolver(cache, self.game.game.rules)
+
+    def run(self, n=1000):
+        """Plays n hands choosing every action from the solver"""
+        self.game.run(self.responder, n=n)
+
+    def known_composition(self):
+        """Composition of the cards unseen by the player
+
+        This is every card left in the deck plus the dealer's hole card.
+        """
+        return tuple(self.game.game.snapshot().composition)
+
+    def responder(self, state):
+        """Responder function choosing the highest EV action
+
+        Args:
+            state: A state dict from a BlackjackGame instance
+        """
+        if state['active']:
+            action, _ = self.solver.best_action(
+                state['player_total'],
+                state['player_soft'],
+                state['dealer_upcard'],
+                self.known_composition())
+            return action
+        else:
+            return None
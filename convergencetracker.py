@@ -0,0 +1,136 @@
+from array import array
+import math
+
+
+class ConvergenceTracker:
+    """Timeline of a learner's policy, sampled every `interval` hands
+
+    At each snapshot the best action and its value are read for every key.
+    Per key, the tracker keeps the hand count at which its best action last
+    flipped and an array('d') of its value at each snapshot, plus one
+    array of the number of keys that flipped. Snapshots cost one
+    action_for_key call per key, negligible next to the hands played
+    between them.
+
+        tracker = ConvergenceTracker(interval=100000)
+        learner.run_explorer(n=10**7, tracker=tracker)
+        tracker.report()['hands_to_convergence']
+    """
+
+    def __init__(self, interval=10000):
+        """Creates an empty timeline
+
+        Args:
+            interval:   Hands between snapshots when passed to run_explorer
+        """
+        if interval < 1:
+            raise ValueError("The interval must be at least one hand")
+        self.interval = interval
+        self._hands = array('q')
+        self._flips = array('l')
+        self._actions = {}
+        self._last_flip = {}
+        self._values = {}
+
+    def __len__(self):
+        """Number of snapshots taken"""
+        return len(self._hands)
+
+    @property
+    def hands(self):
+        """Hand count of each snapshot"""
+        return self._hands
+
+    @property
+    def flips(self):
+        """Number of keys whose best action changed at each snapshot
+
+        Keys seen for the first time are not counted.
+        """
+        return self._flips
+
+    @property
+    def last_flip(self):
+        """Dict of key to the hand count at which its best action last
+        changed, the first snapshot it was seen at if it never did"""
+        return self._last_flip
+
+    def values(self, key):
+        """Value of the best action of key at each snapshot, NaN before the
+        key was first seen"""
+        return self._values.get(key, array('d', [math.nan]) * len(self))
+
+    def observe(self, learner, hands):
+        """Takes a snapshot of the learner's policy
+
+        Args:
+            learner:    ReinforcementLearner or ExtendedLearner
+            hands:      Hands played since the previous snapshot
+        """
+        total = hands + (self._hands[-1] if self._hands else 0)
+        outcomes = learner.outcomes
+        if isinstance(outcomes, dict) and outcomes:
+            # Covers count-indexed keys, which ordered_keys does not list
+            keys = list(outcomes)
+        else:
+            keys = learner.ordered_keys()
+
+        flips = 0
+        for key in keys:
+            action = learner.action_for_key(key)
+            if action is None:
+                continue
+            previous = self._actions.get(key)
+            if previous != action:
+                self._actions[key] = action
+                self._last_flip[key] = total
+                if previous is not None:
+                    flips += 1
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = \
+                    array('d', [math.nan]) * len(self._hands)
+            series.append(self._value(learner, key, action))
+
+        # Keys missing from this snapshot keep their series aligned
+        for series in self._values.values():
+            if len(series) == len(self._hands):
+                series.append(math.nan)
+        self._hands.append(total)
+        self._flips.append(flips)
+
+    @staticmethod
+    def _value(learner, key, action):
+        """Value estimate of action for key in either learner type"""
+        if hasattr(learner, 'value'):
+            value = learner.value(key, action)
+            return math.nan if value is None else value
+        return learner.outcomes[key][action].value
+
+    def report(self, quantiles=(0.5, 0.9, 0.99, 1.0)):
+        """Summarizes how many hands each key needed to settle
+
+        Args:
+            quantiles:  Fractions of keys to report hands-to-convergence for
+
+        Returns:
+            A dict with the number of snapshots, the hands played, the
+            number of keys, the hands after which each quantile of keys
+            never flipped again and the keys still flipping in the last
+            snapshot
+        """
+        settled = sorted(self._last_flip.values())
+        convergence = {}
+        for q in quantiles:
+            if settled:
+                index = max(0, math.ceil(q * len(settled)) - 1)
+                convergence[q] = settled[index]
+        last = self._hands[-1] if self._hands else 0
+        return {
+            'snapshots': len(self),
+            'hands': last,
+            'keys': len(settled),
+            'hands_to_convergence': convergence,
+            'unsettled': sorted(k for k, h in self._last_flip.items()
+                                if h == last and len(self) > 1)
+        }
@@ -1,4 +1,24 @@
+import math
 import random
+import sys
+
+
+# Tag values per card value (Ace is 1, all ten-valued cards are 10)
+HI_LO = {1: -1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1, 7: 0, 8: 0, 9: 0, 10: -1}
+KO = {1: -1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1, 7: 1, 8: 0, 9: 0, 10: -1}
+HI_OPT_I = {1: 0, 2: 0, 3: 1, 4: 1, 5: 1, 6: 1, 7: 0, 8: 0, 9: 0, 10: -1}
+HI_OPT_II = {1: 0, 2: 1, 3: 1, 4: 2, 5: 2, 6: 1, 7: 1, 8: 0, 9: 0, 10: -2}
+ZEN = {1: -1, 2: 1, 3: 1, 4: 2, 5: 2, 6: 2, 7: 1, 8: 0, 9: 0, 10: -2}
+OMEGA_II = {1: 0, 2: 1, 3: 1, 4: 2, 5: 2, 6: 2, 7: 1, 8: 0, 9: -1, 10: -2}
+
+TAG_SYSTEMS = {
+    'hi-lo': HI_LO,
+    'ko': KO,
+    'hi-opt-i': HI_OPT_I,
+    'hi-opt-ii': HI_OPT_II,
+    'zen': ZEN,
+    'omega-ii': OMEGA_II
+}
 
 
 class Card:
@@ -57,16 +77,32 @@ class Card:
 
 class Deck:
 
-    def __init__(self):
-        """Creates a standard 52-card deck"""
+    def __init__(self, tags=HI_LO, decks=1):
+        """Creates a standard 52-card deck, or a shoe of several decks
+
+        The deck keeps a count of the remaining cards of each value and a
+        running count of the drawn cards, both updated on every draw.
+
+        Args:
+            tags:   A dict of tag values per card value used for the running
+                    count, one of TAG_SYSTEMS or any custom system
+            decks:  Number of 52-card decks combined into the shoe
+        """
         values = ['Ace', '2', '3', '4', '5', '6', '7',
                   '8', '9', '10', 'Jack', 'Queen', 'King']
         suits = ['Clubs', 'Diamonds', 'Hearts', 'Spades']
         self._cards = []
+        self._counts = [0] * 10
 
-        for s in suits:
-            for v in values:
-                self._cards.append(Card(v, s))
+        for d in range(decks):
+            for s in suits:
+                for v in values:
+                    card = Card(v, s)
+                    self._cards.append(card)
+                    self._counts[card.value - 1] += 1
+
+        self._tags = [0] + [tags[v] for v in range(1, 11)]
+        self._running_count = 0
 
     def __len__(self):
         """The current length of the deck"""
@@ -81,9 +117,35 @@ class Deck:
         """Provides readonly access to the cards list"""
         return self._cards
 
-    def shuffle(self):
-        """Randomizes the deck"""
-        random.shuffle(self._cards)
+    @property
+    def composition(self):
+        """Count of remaining cards per value, Ace first and tens last"""
+        return tuple(self._counts)
+
+    @property
+    def running_count(self):
+        """Sum of the tag values of every card drawn so far"""
+        return self._running_count
+
+    @property
+    def decks_remaining(self):
+        """Number of 52-card decks left to draw"""
+        return len(self._cards) / 52
+
+    @property
+    def true_count(self):
+        """Running count divided by the number of decks remaining"""
+        if not self._cards:
+            return 0.0
+        return self._running_count / self.decks_remaining
+
+    def shuffle(self, rng=None):
+        """Randomizes the deck
+
+        Args:
+            rng:    random.Random to shuffle with, the random module if None
+        """
+        (rng or random).shuffle(self._cards)
 
     def draw(self, n=1):
         """Draws a specified number of cards
@@ -102,11 +164,129 @@ class Deck:
 
         cards = []
         for x in range(n):
-            cards.append(self._cards.pop())
+            card = self._cards.pop()
+            value = card.value
+            self._counts[value - 1] -= 1
+            self._running_count += self._tags[value]
+            cards.append(card)
 
         return cards
 
 
+# Random bytes below 208 map to 13 ranks of 16 bytes each, the rest are
+# dropped, so every rank is exactly equally likely
+_RANK_BYTES = 208
+_REJECTED = bytes(range(_RANK_BYTES, 256))
+RANK_TABLE = bytes(b // 16 for b in range(_RANK_BYTES)) + _REJECTED
+VALUE_TABLE = bytes(min(b // 16 + 1, 10)
+                    for b in range(_RANK_BYTES)) + _REJECTED
+
+
+def random_ranks(rng, size, table=RANK_TABLE):
+    """Returns a bytes buffer of uniformly drawn ranks
+
+    One call to rng.randbytes produces the whole buffer, which
+    bytes.translate then maps to ranks and filters in C. About 81% of
+    the random bytes survive the filter.
+
+    Args:
+        rng:    A random.Random instance
+        size:   Number of random bytes to draw
+        table:  RANK_TABLE for ranks 0-12 (Ace to King), or VALUE_TABLE for
+                blackjack values 1-10
+    """
+    return rng.randbytes(size).translate(table, _REJECTED)
+
+
+def infinite_values(seed=None, buffer_size=1 << 16):
+    """Yields blackjack values of an infinite deck, refilled in bulk"""
+    rng = random.Random(seed)
+    while True:
+        yield from random_ranks(rng, buffer_size, VALUE_TABLE)
+
+
+class InfiniteDeck:
+    """An endless shoe, every card is drawn with replacement
+
+    Ranks are taken from large buffers of pre-generated random bytes, so
+    a draw makes no call into the random number generator, and the shoe
+    is never rebuilt or shuffled. Ten-valued cards come up 4 times in 13,
+    like in any real shoe. It has the same draw interface as Deck, so it
+    can be used as a BlackjackGame's deck (see RuleSet with decks=0).
+
+    Card counting has no effect on an infinite deck, so the running and
+    true counts are always 0.
+    """
+
+    RANKS = ['Ace', '2', '3', '4', '5', '6', '7',
+             '8', '9', '10', 'Jack', 'Queen', 'King']
+
+    def __init__(self, tags=HI_LO, seed=None, buffer_size=1 << 16,
+                 rng=None):
+        """Creates the shoe
+
+        Args:
+            tags:           Accepted for compatibility with Deck, unused
+            seed:           Seed of the shoe's generator. If None it is
+                            seeded from rng, so a seeded rng makes games
+                            reproducible as with a Deck
+            buffer_size:    Random bytes drawn per refill
+            rng:            random.Random the seed is taken from when none
+                            is given, the random module if None
+        """
+        if seed is None:
+            seed = (rng or random).getrandbits(64)
+        self._rng = random.Random(seed)
+        self._buffer_size = buffer_size
+        self._cards = [Card(rank, 'Spades') for rank in InfiniteDeck.RANKS]
+        self._ranks = b''
+        self._position = 0
+
+    def __len__(self):
+        """The shoe never runs out"""
+        return sys.maxsize
+
+    @property
+    def composition(self):
+        """Card proportions of the shoe, as counts per value of one deck"""
+        return (4,) * 9 + (16,)
+
+    @property
+    def running_count(self):
+        """Always 0, drawn cards do not change an infinite shoe"""
+        return 0
+
+    @property
+    def decks_remaining(self):
+        """Infinitely many"""
+        return math.inf
+
+    @property
+    def true_count(self):
+        """Always 0.0"""
+        return 0.0
+
+    def shuffle(self, rng=None):
+        """Does nothing, every draw is already independent
+
+        Args:
+            rng:    Accepted for compatibility with Deck, unused
+        """
+        pass
+
+    def draw(self, n=1):
+        """Draws n cards, see Deck.draw"""
+        position = self._position
+        if position + n > len(self._ranks):
+            self._ranks = self._ranks[position:]
+            position = 0
+            while n > len(self._ranks):
+                self._ranks += random_ranks(self._rng, self._buffer_size)
+        self._position = position + n
+        return list(map(self._cards.__getitem__,
+                        self._ranks[position:position + n]))
+
+
 class EmptyDeckError(Exception):
     """Raised when attempting to draw on an empty deck"""
     pass
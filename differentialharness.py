@@ -0,0 +1,178 @@
+from blackjackgame import BlackjackGame
+from blackjackgamerunner import BlackjackGameRunner
+from deck import Card
+from fastengine import FastEngine, SequenceSource, seeded_values
+import math
+
+
+class ReplayGame(BlackjackGame):
+    """A BlackjackGame dealing from a fixed sequence of card values
+
+    Cards are taken in order from the sequence instead of from a shuffled
+    Deck, so two engines given the same sequence see the same cards.
+    """
+
+    # One representative card per blackjack value
+    CARDS = [None] + [Card('Ace', 'Spades')] + \
+        [Card(v, 'Spades') for v in range(2, 11)]
+
+    def __init__(self, values, **kwargs):
+        """Creates the game
+
+        Args:
+            values: Iterable of card values (1 for an Ace, 10 for tens)
+        """
+        super().__init__(**kwargs)
+        self._values = iter(values)
+
+    def safe_draw(self, n):
+        """Draws the next n values of the sequence as Card objects"""
+        return [ReplayGame.CARDS[next(self._values)] for _ in range(n)]
+
+
+class ReferenceEngine:
+    """Wraps the reference BlackjackGame with the FastEngine interface"""
+
+    def __init__(self, source, rules=None):
+        """Creates a runner over a ReplayGame fed from source"""
+        values = iter(source.draw, None)
+        self.runner = BlackjackGameRunner(
+            ReplayGame(values, rules=rules, naturals=True))
+
+    def play_hand(self, policy, decisions=None):
+        """Plays one hand through BlackjackGameRunner.run
+
+        Args and return value are the same as FastEngine.play_hand
+        """
+        result = []
+
+        def responder(state):
+            if state['prevstate'] is not None and decisions is not None:
+                decisions.append(state['prevstate'])
+            if state['active']:
+                return policy(state['player_total'],
+                              state['player_soft'],
+                              state['dealer_upcard'])
+            result.append(self.runner.game.score)
+            return None
+
+        self.runner.run(responder, n=1)
+        return result[0]
+
+
+class DifferentialHarness:
+    """Checks an alternative engine against the reference BlackjackGame
+
+    Both engines are fed identical seeded card sequences and a deterministic
+    policy. `compare` requires every hand to match exactly, while
+    `compare_tallies` runs both engines on independent seeds and tests that
+    their outcome frequencies agree statistically.
+
+        harness = DifferentialHarness(FastEngine, policy)
+        harness.compare(seeds=range(10), n=1000)
+        harness.compare_tallies(n=1000000)
+    """
+
+    def __init__(self, engine, policy, reference=ReferenceEngine, decks=1,
+                 rules=None):
+        """Creates the harness
+
+        Args:
+            engine:     Engine class or factory taking a card source and a
+                        RuleSet
+            policy:     Deterministic function of (player_total, player_soft,
+                        dealer_upcard) returning 'hit' or 'stand'
+            reference:  Engine the candidate is checked against
+            decks:      Decks per shuffle of the seeded card sequences
+            rules:      The RuleSet both engines play by
+        """
+        self.engine = engine
+        self.reference = reference
+        self.policy = policy
+        self.decks = decks
+        self.rules = rules
+
+    def hands(self, engine, seed, n):
+        """Plays n hands and returns a list of (score, decisions) tuples"""
+        game = engine(SequenceSource(seeded_values(seed, self.decks)),
+                      self.rules)
+        hands = []
+        for _ in range(n):
+            decisions = []
+            score = game.play_hand(self.policy, decisions)
+            hands.append((score, decisions))
+        return hands
+
+    def compare(self, seeds, n):
+        """Asserts identical per-hand outcomes and prevstate keys
+
+        Args:
+            seeds:  Seeds of the card sequences to replay
+            n:      Hands per seed
+
+        Returns:
+            Number of hands compared
+
+        Raises:
+            EngineMismatchError: On the first hand that differs
+        """
+        compared = 0
+        for seed in seeds:
+            expected = self.hands(self.reference, seed, n)
+            actual = self.hands(self.engine, seed, n)
+            for i in range(n):
+                if expected[i] != actual[i]:
+                    raise EngineMismatchError(
+                        f"Seed {seed}, hand {i}: expected {expected[i]}, "
+                        f"got {actual[i]}")
+            compared += n
+        return compared
+
+    def tally(self, engine, seed, n):
+        """Returns counts of wins, pushes and losses over n hands"""
+        game = engine(SequenceSource(seeded_values(seed, self.decks)),
+                      self.rules)
+        counts = {1: 0, 0: 0, -1: 0}
+        for _ in range(n):
+            score = game.play_hand(self.policy)
+            counts[(score > 0) - (score < 0)] += 1
+        return {'Win': counts[1], 'Push': counts[0], 'Loss': counts[-1]}
+
+    def compare_tallies(self, n, seed=0, threshold=4.0):
+        """Compares outcome frequencies of the engines on independent seeds
+
+        A two-proportion z statistic is computed for each outcome. With
+        independent seeds the engines should only ever differ by chance.
+
+        Args:
+            n:          Hands played by each engine
+            seed:       Seed of the reference run, the candidate uses seed + 1
+            threshold:  Largest |z| accepted
+
+        Returns:
+            A dict of z statistics per outcome
+
+        Raises:
+            EngineMismatchError: When any |z| exceeds the threshold
+        """
+        expected = self.tally(self.reference, seed, n)
+        actual = self.tally(self.engine, seed + 1, n)
+
+        zscores = {}
+        for outcome in expected:
+            pooled = (expected[outcome] + actual[outcome]) / (2 * n)
+            stderr = math.sqrt(pooled * (1 - pooled) * 2 / n)
+            diff = (actual[outcome] - expected[outcome]) / n
+            zscores[outcome] = diff / stderr if stderr else 0.0
+
+        for outcome, z in zscores.items():
+            if abs(z) > threshold:
+                raise EngineMismatchError(
+                    f"{outcome} frequency differs, z = {z:.2f} "
+                    f"(expected {expected}, got {actual})")
+        return zscores
+
+
+class EngineMismatchError(Exception):
+    """Raised when an engine disagrees with the reference game"""
+    pass
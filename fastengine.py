@@ -0,0 +1,133 @@
+from deck import infinite_values
+from ruleset import RuleSet
+import random
+
+
+def seeded_values(seed=None, decks=1):
+    """Yields card values from an endless series of seeded shuffled decks
+
+    Values follow the blackjack convention of Ace as 1 and all ten-valued
+    cards as 10. The same seed always yields the same sequence.
+
+    Args:
+        seed:   Seed for the shuffles
+        decks:  Number of 52-card decks per shuffle, 0 for an infinite deck
+                drawn from bulk random buffers (see infinite_values)
+    """
+    if decks == 0:
+        yield from infinite_values(seed)
+    rng = random.Random(seed)
+    shoe = [min(v, 10) for v in range(1, 14)] * 4 * decks
+    while True:
+        rng.shuffle(shoe)
+        yield from shoe
+
+
+def state_key(total, soft, upcard):
+    """Formats a state key the same way as BlackjackGame.prevstate_tup"""
+    return f"{'S' if soft else 'H'}{total}-{upcard}"
+
+
+class SequenceSource:
+    """Card source drawing integer values from an iterable"""
+
+    def __init__(self, values):
+        """Creates the source
+
+        Args:
+            values: Any iterable of card values, eg: seeded_values(seed)
+        """
+        self.draw = iter(values).__next__
+
+
+class FastEngine:
+    """Integer-only blackjack engine for hit/stand play
+
+    Plays the same rules as a BlackjackGame driven by a BlackjackGameRunner,
+    but represents cards as plain integers and hands as running sums, and
+    asks a policy function for decisions instead of building state dicts.
+    Use the DifferentialHarness to check it against the reference game.
+    """
+
+    def __init__(self, source, rules=None):
+        """Creates an engine
+
+        Args:
+            source: Card source with a `draw()` method returning a value
+            rules:  The RuleSet to play by, the defaults if None
+        """
+        self._draw = source.draw
+        self.rules = rules if rules is not None else RuleSet()
+
+    def play_hand(self, policy, decisions=None):
+        """Deals and plays a single hand
+
+        Args:
+            policy:     Function of (player_total, player_soft, dealer_upcard)
+                        returning 'hit' or 'stand'
+            decisions:  Optional list, each decision is appended to it as a
+                        (state key, action) tuple like BlackjackGame.prevstate
+
+        Returns:
+            The score of the hand, 1 for a win, 0 for a push, -1 for a loss
+            and the rules' payout for a blackjack
+        """
+        draw = self._draw
+        rules = self.rules
+
+        # Same order as BlackjackGame.deal, the dealer's two cards first
+        upcard = draw()
+        dealer_hard = upcard + draw()
+        dealer_ace = upcard == 1 or dealer_hard - upcard == 1
+        first = draw()
+        player_hard = first + draw()
+        player_ace = first == 1 or player_hard - first == 1
+        shown = 11 if upcard == 1 else upcard
+
+        dealer_blackjack = dealer_ace and dealer_hard == 11
+        if player_ace and player_hard == 11:
+            return 0 if dealer_blackjack else rules.blackjack_payout
+        if dealer_blackjack and rules.dealer_peek:
+            return -1
+
+        while True:
+            soft = player_ace and player_hard <= 11
+            total = player_hard + 10 if soft else player_hard
+            if total > 21:
+                return -1
+
+            action = policy(total, soft, shown)
+            if decisions is not None:
+                decisions.append((state_key(total, soft, shown), action))
+
+            if action == 'hit':
+                card = draw()
+                player_hard += card
+                player_ace = player_ace or card == 1
+            elif action == 'stand':
+                break
+            else:
+                raise ValueError(f"Invalid action {action!r}")
+
+        if dealer_blackjack:
+            return -1
+
+        dealer_soft = dealer_ace and dealer_hard <= 11
+        dealer_total = dealer_hard + 10 if dealer_soft else dealer_hard
+        while rules.dealer_must_hit(dealer_total, dealer_soft):
+            card = draw()
+            dealer_hard += card
+            dealer_ace = dealer_ace or card == 1
+            dealer_soft = dealer_ace and dealer_hard <= 11
+            dealer_total = dealer_hard + 10 if dealer_soft else dealer_hard
+
+        if total > dealer_total or dealer_total > 21:
+            return 1
+        elif total == dealer_total:
+            return 0
+        else:
+            return -1
+
+    def play(self, policy, n):
+        """Plays n hands and returns the list of their scores"""
+        return [self.play_hand(policy) for _ in range(n)]
@@ -0,0 +1,352 @@
+from outcomestore import hash_key
+import bisect
+import heapq
+import json
+import mmap
+import os
+import stateindex
+import struct
+
+MAGIC = b'RLBJHIDX'
+VERSION = 1
+
+# magic, version, padded to 16
+HEADER = struct.Struct('<8sI4x')
+# Entries in the run, data bytes indexed once the run is included
+RUN = struct.Struct('<QQ')
+# Hash of the (key, action) pair, offset of the hand in the data file
+ENTRY = struct.Struct('<qQ')
+
+
+def index_hash(key, action):
+    """Index hash of a state key and action, eg: ('S18-9', 'hit')"""
+    return hash_key(f"{key}\t{action}")
+
+
+class HandHistory:
+    """Append-only store of played hands with a per-state index
+
+    Hands are written to the data file as one JSON line each, holding the
+    (key, action) decisions in the order they were made, the per-decision
+    results of BlackjackGame.results(), the net score and the outcome.
+    Keys are those of BlackjackGame.prevstate_tup.
+
+    The index lives next to the data in `<path>.idx`. While writing, the
+    offset of each hand is kept in memory under the hash of every (key,
+    action) it passed through, and each flush appends those postings to
+    the index as a new run sorted by hash. Finding the hands of a state is
+    then a binary search per run followed by reads of the matching lines
+    only, so queries do not grow with the hands that do not match.
+    compact() merges the runs into one.
+
+        with HandHistory('hands.jsonl') as history:
+            BlackjackGameRunner(game).run(history.recorder(game, responder),
+                                          n=10**6)
+            hits = list(history.query('S18-9', 'hit'))
+
+    Hands written after the last flush are indexed again when the file is
+    next opened, so a crash loses no index entries.
+    """
+
+    def __init__(self, path, flush_every=100000, readonly=False):
+        """Opens or creates a history
+
+        Args:
+            path:           The data file, the index is `path + '.idx'`
+            flush_every:    Hands between index flushes while writing
+            readonly:       Open for queries only, nothing is written
+
+        Raises:
+            ValueError: If the index file is not a hand history index
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self.flush_every = flush_every
+        self.readonly = readonly
+        self._pending = {}
+        self._unflushed = 0
+        self._runs = []
+        self._map = None
+        self._entries = None
+        self._indexed = 0
+
+        if readonly:
+            self._data = None
+        else:
+            self._data = open(path, 'ab')
+            if not os.path.exists(self.index_path) or \
+                    os.path.getsize(self.index_path) < HEADER.size:
+                with open(self.index_path, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, VERSION))
+        self._reader = open(path, 'rb')
+        self._load_index()
+        self._index_tail()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load_index(self):
+        """Maps the index file and reads the position of its runs
+
+        A run cut short by a crash is ignored, along with anything after
+        it; its hands are past the indexed data and are indexed again.
+        """
+        self._release()
+        self._runs = []
+        self._indexed = 0
+        if not os.path.exists(self.index_path):
+            return
+        size = os.path.getsize(self.index_path)
+        if size < HEADER.size:
+            return
+        with open(self.index_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._release()
+            raise ValueError(f"{self.index_path} is not a hand history "
+                             f"index of version {VERSION}")
+        self._entries = memoryview(self._map).cast('q')
+
+        position = HEADER.size
+        while position + RUN.size <= size:
+            count, indexed = RUN.unpack_from(self._map, position)
+            start = position + RUN.size
+            end = start + count * ENTRY.size
+            if end > size:
+                break
+            # Runs as (first entry, entries), counted in 8 byte words
+            self._runs.append((start // 8, count))
+            self._indexed = indexed
+            position = end
+
+        if position < size and not self.readonly:
+            self._release()
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(position)
+            self._load_index()
+
+    def _release(self):
+        """Releases the index mapping"""
+        if self._entries is not None:
+            self._entries.release()
+            self._entries = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _index_tail(self):
+        """Adds the hands past the indexed data to the pending postings"""
+        reader = self._reader
+        reader.seek(self._indexed)
+        offset = self._indexed
+        for line in reader:
+            if not line.endswith(b'\n'):
+                # A hand cut short by a crash, overwritten by the next one
+                if self._data is not None:
+                    self._data.truncate(offset)
+                    self._data.seek(offset)
+                break
+            self._add(offset, json.loads(line)['decisions'])
+            offset += len(line)
+
+    def _add(self, offset, decisions):
+        """Adds the postings of a hand to the pending ones"""
+        pending = self._pending
+        for h in {index_hash(key, action) for key, action in decisions}:
+            postings = pending.get(h)
+            if postings is None:
+                pending[h] = [offset]
+            else:
+                postings.append(offset)
+
+    def append(self, decisions, results=(), score=0, outcome=None):
+        """Writes a hand to the history
+
+        Args:
+            decisions:  List of the (key, action) decisions of the hand
+            results:    List of (key, action, score) credits, as the
+                        prevstates and scores of BlackjackGame.results()
+            score:      Net score of the hand
+            outcome:    Outcome string, eg: 'Win'
+
+        Returns:
+            Offset of the hand in the data file
+        """
+        if self._data is None:
+            raise IOError(f"{self.path} was opened read-only")
+        record = {'decisions': [list(d) for d in decisions],
+                  'results': [list(r) for r in results],
+                  'score': score, 'outcome': outcome}
+        offset = self._data.tell()
+        self._data.write(json.dumps(record).encode() + b'\n')
+        self._add(offset, record['decisions'])
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+        return offset
+
+    def recorder(self, game, responder):
+        """Wraps a responder so that every hand it plays is written
+
+        Args:
+            game:       The BlackjackGame the responder is run on
+            responder:  Responder function, see BlackjackGameRunner.run
+
+        Returns:
+            A responder function for BlackjackGameRunner.run
+        """
+        decisions = []
+
+        def record(state):
+            response = responder(state)
+            if state['active']:
+                decisions.append(game.prevstate_tup(response))
+            else:
+                results = [(prevstate[0], prevstate[1], score)
+                           for prevstate, _, score in game.results()
+                           if prevstate is not None]
+                self.append(decisions, results, game.score,
+                            state['outcome'])
+                decisions.clear()
+            return response
+        return record
+
+    def flush(self):
+        """Writes the data and appends the pending postings as a new run"""
+        if self._data is None:
+            return
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        if self._pending:
+            entries = [(h, offset) for h in sorted(self._pending)
+                       for offset in self._pending[h]]
+            self._release()
+            with open(self.index_path, 'ab') as f:
+                f.write(RUN.pack(len(entries), self._data.tell()))
+                f.write(b''.join(ENTRY.pack(*e) for e in entries))
+            self._pending = {}
+            self._load_index()
+        self._unflushed = 0
+
+    def compact(self):
+        """Merges every run of the index into one"""
+        self.flush()
+        if self._data is None or len(self._runs) < 2:
+            return
+        # The runs are already sorted, so they are merged as streams
+        runs = [self._run_entries(start, count)
+                for start, count in self._runs]
+        total = sum(count for _, count in self._runs)
+        temporary = self.index_path + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION))
+                f.write(RUN.pack(total, self._indexed))
+                for entry in heapq.merge(*runs):
+                    f.write(ENTRY.pack(*entry))
+            self._release()
+            os.replace(temporary, self.index_path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            self._load_index()
+
+    def _run_entries(self, start, count):
+        """Yields the (hash, offset) entries of a run in order"""
+        entries = self._entries
+        for word in range(start, start + 2 * count, 2):
+            yield entries[word], entries[word + 1]
+
+    @property
+    def runs(self):
+        """Number of sorted runs in the index"""
+        return len(self._runs)
+
+    def offsets(self, key, action=None):
+        """Data file offsets of the hands that took action at key
+
+        Args:
+            key:    State key, eg: 'S18-9'
+            action: The action, or None for any action
+
+        Returns:
+            A sorted list of offsets. Hash collisions are possible, so
+            query() checks each hand.
+        """
+        actions = stateindex.ACTIONS if action is None else (action,)
+        entries = self._entries
+        found = set()
+        for action in actions:
+            h = index_hash(key, action)
+            found.update(self._pending.get(h, ()))
+            for start, count in self._runs:
+                hashes = entries[start:start + 2 * count:2]
+                first = bisect.bisect_left(hashes, h)
+                last = bisect.bisect_right(hashes, h, first)
+                found.update(entries[start + 2 * first + 1:
+                                     start + 2 * last + 1:2])
+        return sorted(found)
+
+    def query(self, key, action=None):
+        """Yields the hands that took action at key, in the order written
+
+        Args:
+            key:    State key, eg: 'S18-9'
+            action: The action, or None for any action
+
+        Yields:
+            Hand records, dicts of 'decisions', 'results', 'score' and
+            'outcome'
+        """
+        if self._data is not None:
+            self._data.flush()
+        reader = self._reader
+        for offset in self.offsets(key, action):
+            reader.seek(offset)
+            record = json.loads(reader.readline())
+            if any(k == key and (action is None or a == action)
+                   for k, a in record['decisions']):
+                yield record
+
+    def retally(self, learner, key, action=None):
+        """Credits a learner with the results of key from matching hands
+
+        Only the results held by the hands are credited: like
+        BlackjackGame.results(), a decision followed by another in the same
+        hand has none.
+
+        Args:
+            learner:    ReinforcementLearner or ExtendedLearner to update
+            key:        State key, eg: 'S18-9'
+            action:     The action, or None for any action
+
+        Returns:
+            Number of results credited
+        """
+        credited = 0
+        for record in self.query(key, action):
+            for k, a, score in record['results']:
+                if k == key and (action is None or a == action):
+                    learner.record(k, a, score)
+                    credited += 1
+        return credited
+
+    def close(self, index=True):
+        """Flushes the index and closes the files
+
+        Args:
+            index:  When False the hands written since the last flush are
+                    left out of the index, as after a crash. They are
+                    indexed again when the history is next opened.
+        """
+        if self._data is not None:
+            if index:
+                self.flush()
+            self._data.close()
+            self._data = None
+        self._release()
+        self._reader.close()
@@ -0,0 +1,201 @@
+import json
+import os
+import queue
+import socket
+import stat
+import sys
+import threading
+
+# Outcome strings of BlackjackGame.outcome_str and the score credited
+OUTCOME_SCORES = {'Win': 1, 'Push': 0, 'Loss': -1}
+
+_END = object()
+
+
+def read_lines(source):
+    """Yields the lines of a hand record source
+
+    Args:
+        source: One of
+                - an open file, a list of lines or any iterable of lines
+                - '-' for standard input
+                - a path to a regular file or named pipe
+                - a path to a Unix domain socket, which is connected to
+                - a (host, port) tuple, which is connected to over TCP
+    """
+    if isinstance(source, tuple):
+        with socket.create_connection(source) as sock:
+            yield from sock.makefile('r')
+    elif source == '-':
+        yield from sys.stdin
+    elif isinstance(source, str):
+        if stat.S_ISSOCK(os.stat(source).st_mode):
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(source)
+                yield from sock.makefile('r')
+        else:
+            with open(source) as f:
+                yield from f
+    else:
+        yield from source
+
+
+def parse_records(lines):
+    """Yields (prevstate, action, score) tuples from lines of JSON
+
+    Each line holds a list [prevstate, action, outcome] or a dict with
+    those three keys. The outcome is a score or one of 'Win', 'Push' and
+    'Loss'. Blank lines are skipped.
+
+    Raises:
+        ValueError: For a line that is not a valid record
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                record = (record['prevstate'], record['action'],
+                          record['outcome'])
+            prevstate, action, outcome = record
+            score = OUTCOME_SCORES.get(outcome, outcome)
+            if not isinstance(score, (int, float)):
+                raise TypeError(f"Invalid outcome {outcome!r}")
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Invalid hand record on line {number}: {e}")
+        yield prevstate, action, score
+
+
+def buffered(iterable, size):
+    """Iterates over iterable in a background thread through a bounded queue
+
+    The thread stops pulling from iterable while `size` items are waiting,
+    so a fast producer is held back to the pace of the consumer. For socket
+    and pipe sources that pressure reaches the writer, whose writes block
+    once the operating system buffers fill up.
+
+    Exceptions raised by iterable are re-raised in the consumer. When the
+    consumer stops early, by closing the generator or through an
+    exception, the thread is told to stop and the waiting items are
+    dropped so that it is not left blocked on the queue. It then closes
+    iterable, along with any socket or file behind it, once its current
+    item has been read.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    failure = []
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    break
+                items.put(item)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+            if not stop.is_set():
+                items.put(_END)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Frees the producer if it is blocked on a full queue
+        while True:
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                break
+    if failure:
+        raise failure[0]
+
+
+class HandStream:
+    """Folds a stream of hand records into a learner as they arrive
+
+    Records pass through a generator pipeline, source lines to parsed
+    records to a bounded buffer, and are tallied into the learner one at a
+    time, so memory stays fixed however long the stream runs. Every
+    `snapshot_every` records the learner's current policy is captured.
+
+        stream = HandStream(ReinforcementLearner(), snapshot_every=10000)
+        stream.ingest('hands.jsonl')
+        stream.ingest(('localhost', 9000))
+    """
+
+    def __init__(self, learner, buffer_size=1024, snapshot_every=10000,
+                 on_snapshot=None):
+        """Creates the stream
+
+        Args:
+            learner:        ReinforcementLearner or ExtendedLearner to update
+            buffer_size:    Most records buffered between source and learner
+            snapshot_every: Records between policy snapshots
+            on_snapshot:    Optional function of (records, policy) called
+                            with each snapshot
+        """
+        self.learner = learner
+        self.buffer_size = buffer_size
+        self.snapshot_every = snapshot_every
+        self.on_snapshot = on_snapshot
+        self._records = 0
+        self._snapshot = None
+
+    @property
+    def records(self):
+        """Total number of records ingested"""
+        return self._records
+
+    @property
+    def snapshot(self):
+        """The latest policy snapshot, a dict of key to action"""
+        return self._snapshot
+
+    def take_snapshot(self):
+        """Captures the learner's current policy over all basic keys"""
+        policy = {}
+        for key in self.learner.ordered_keys():
+            action = self.learner.action_for_key(key)
+            if action is not None:
+                policy[key] = action
+        self._snapshot = policy
+        if self.on_snapshot is not None:
+            self.on_snapshot(self._records, policy)
+        return policy
+
+    def ingest(self, source):
+        """Reads a source to its end, updating the learner as it goes
+
+        Args:
+            source: Anything read_lines accepts
+
+        A final snapshot is taken unless the last record just took one.
+
+        Returns:
+            Number of records ingested from this source
+        """
+        record = self.learner.record
+        records = buffered(parse_records(read_lines(source)),
+                           self.buffer_size)
+        start = self._records
+        try:
+            for prevstate, action, score in records:
+                record(prevstate, action, score)
+                self._records += 1
+                if self._records % self.snapshot_every == 0:
+                    self.take_snapshot()
+        finally:
+            records.close()
+        if self._records == start or self._records % self.snapshot_every:
+            self.take_snapshot()
+        return self._records - start
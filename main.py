@@ -2,11 +2,18 @@ from deck import *
 from blackjackgame import *
 from blackjackgamerunner import *
 from reinforcementlearner import *
+from convergencetracker import *
 
 if __name__ == "__main__":
     explorer = ReinforcementLearner()
-    explorer.run_explorer(n=10000)
+    tracker = ConvergenceTracker(interval=1000)
+    explorer.run_explorer(n=10000, tracker=tracker)
 
     for key in explorer.ordered_keys():
         if key in explorer.outcomes:
-            print(f"{key}: {explorer.action_with_diff(key)}")
+            print(f"{key}: {explorer.action_with_diff(key)} "
+                  f"(settled after {tracker.last_flip[key]} hands)")
+
+    report = tracker.report()
+    for q, hands in report['hands_to_convergence'].items():
+        print(f"{q:.0%} of keys settled after {hands} hands")
@@ -0,0 +1,173 @@
+import gc
+import os
+import sys
+import inspect
+import tracemalloc
+
+# Code flags of generators and coroutines, whose frame objects outlive a call
+_GENERATOR = inspect.CO_GENERATOR | inspect.CO_COROUTINE | \
+    inspect.CO_ASYNC_GENERATOR | inspect.CO_ITERABLE_COROUTINE
+
+
+class AllocationProfile:
+    """Result of a MemoryProfiler run"""
+
+    def __init__(self, hands, sites, peak_bytes, table_bytes, collections):
+        self._hands = hands
+        self._sites = sites
+        self._peak_bytes = peak_bytes
+        self._table_bytes = table_bytes
+        self._collections = collections
+
+    @property
+    def hands(self):
+        """Number of hands profiled"""
+        return self._hands
+
+    @property
+    def sites(self):
+        """Dict of (filename, line) to the blocks allocated there"""
+        return self._sites
+
+    @property
+    def allocations(self):
+        """Total blocks allocated over all hands"""
+        return sum(self._sites.values())
+
+    @property
+    def per_hand(self):
+        """Average blocks allocated per hand"""
+        return self.allocations / self._hands if self._hands else 0.0
+
+    @property
+    def peak_bytes(self):
+        """Peak memory traced by tracemalloc during the run"""
+        return self._peak_bytes
+
+    @property
+    def table_bytes(self):
+        """Memory of the learner's outcome table after the run, if given"""
+        return self._table_bytes
+
+    @property
+    def gc_collections(self):
+        """Garbage collections run during the profile, per generation"""
+        return self._collections
+
+    def per_hand_in(self, filename):
+        """Average blocks per hand allocated by lines of one source file"""
+        total = sum(blocks for (path, _), blocks in self._sites.items()
+                    if os.path.basename(path) == filename)
+        return total / self._hands if self._hands else 0.0
+
+    def top(self, n=10):
+        """The n sites allocating the most, as ('file:line', per hand)"""
+        ranked = sorted(self._sites.items(), key=lambda s: -s[1])[:n]
+        return [(f"{os.path.basename(path)}:{line}", blocks / self._hands)
+                for (path, line), blocks in ranked]
+
+    def report(self, n=10):
+        """Returns a printable summary of the profile"""
+        lines = [f"{self.hands} hands, {self.per_hand:.1f} blocks per hand, "
+                 f"peak {self.peak_bytes} bytes"]
+        if self.table_bytes is not None:
+            lines.append(f"Outcome table: {self.table_bytes} bytes")
+        lines.append(f"GC collections: {self.gc_collections}")
+        for site, blocks in self.top(n):
+            lines.append(f"  {blocks:8.2f}  {site}")
+        return '\n'.join(lines)
+
+
+class MemoryProfiler:
+    """Opt-in allocation profiler for the hand loop
+
+    Every line executed while profiling is traced with sys.settrace, and
+    the change in sys.getallocatedblocks() across the line is credited to
+    it. A site's count is therefore the number of memory blocks the line
+    leaves allocated when it finishes, such as a state dict or a Hand that
+    outlives the line creating it. Temporaries freed within the same line
+    and objects reused from CPython's free lists are not seen, so counts
+    are a lower bound on allocator traffic, but they are deterministic for
+    a seeded run, which is what allocation budgets need. tracemalloc runs
+    alongside for the peak.
+
+    The frame object CPython creates for tracing each call is not counted,
+    except once per generator. Tracing slows the loop down by one to two
+    orders of magnitude, so only use it on a few thousand hands.
+
+        profile = MemoryProfiler().profile_explorer(learner, n=2000)
+        print(profile.report())
+    """
+
+    def profile(self, play, hands, learner=None):
+        """Profiles a function playing a number of hands
+
+        Args:
+            play:       Function of no arguments playing the hands
+            hands:      Number of hands play plays, for per-hand figures
+            learner:    Optional learner whose memory_usage is reported
+
+        Returns:
+            An AllocationProfile
+        """
+        sites = {}
+        # Blocks at the last event, the blocks of the line since, its site
+        state = [0, 0, None]
+        blocks = sys.getallocatedblocks
+
+        def trace(frame, event, arg):
+            # Every temporary is released before the final count is read, so
+            # the tracer's own work is not credited to the traced lines. The
+            # same function is returned to avoid allocating a bound method.
+            state[1] = blocks() - state[0]
+            if event == 'call' and not frame.f_code.co_flags & _GENERATOR:
+                # The frame object materialized for tracing the call
+                state[1] -= 1
+            if state[1] > 0:
+                sites[state[2]] = sites.get(state[2], 0) + state[1]
+            state[2] = (frame.f_code.co_filename, frame.f_lineno)
+            state[0] = blocks()
+            return trace
+
+        collections = [0, 0, 0]
+
+        def count_collections(phase, info):
+            if phase == 'start':
+                collections[info['generation']] += 1
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        gc.callbacks.append(count_collections)
+        state[0] = blocks()
+        # Any tracer already installed, eg: coverage, is put back after
+        previous = sys.gettrace()
+        sys.settrace(trace)
+        try:
+            play()
+        finally:
+            sys.settrace(previous)
+            gc.callbacks.remove(count_collections)
+            peak = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+
+        # The call that started play() is not part of the hand loop
+        sites.pop(None, None)
+        table = learner.memory_usage() if learner is not None else None
+        return AllocationProfile(hands, sites, peak, table,
+                                 tuple(collections))
+
+    def profile_explorer(self, learner, n, warmup=0):
+        """Profiles n hands of a learner's explorer
+
+        Args:
+            learner:    ReinforcementLearner or ExtendedLearner
+            n:          Hands to profile
+            warmup:     Hands played untraced first, so that one-time costs
+                        such as new outcome table keys are left out
+        """
+        if warmup:
+            learner.run_explorer(n=warmup)
+        return self.profile(lambda: learner.run_explorer(n=n), n, learner)
@@ -0,0 +1,305 @@
+from reinforcementlearner import ScoreTally
+import hashlib
+import mmap
+
+
+def hash_key(key):
+    """Stable, non-zero 64-bit integer hash of a state key string
+
+    Python's built-in hash() is salted per process, so it cannot be used for
+    tables shared through files. Zero is reserved to mark empty slots.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True) or 1
+
+
+def check_key(key):
+    """Second 64-bit hash of a state key, independent of hash_key
+
+    Stored next to hash_key in ArrayOutcomeStore, so two keys are only
+    taken as the same when both hashes agree.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8,
+                             person=b'check').digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class StoredTally(ScoreTally):
+    """A ScoreTally whose score and count live in an ArrayOutcomeStore
+
+    Views are only valid until the store next grows, so they should not be
+    held on to across insertions.
+    """
+
+    def __init__(self, store, position):
+        """Creates a view of one (key, action) tally of the store"""
+        self._store = store
+        self._position = position
+
+    @property
+    def _score(self):
+        return self._store.tally_at(self._position)[0]
+
+    @property
+    def _count(self):
+        return self._store.tally_at(self._position)[1]
+
+    def tally(self, score):
+        """Adds a score to the stored tally and increments its counter"""
+        self._store.add_to_tally(self._position, score, 1)
+
+    def merge(self, score, count):
+        """Adds the total score and count of another tally"""
+        self._store.add_to_tally(self._position, score, count)
+
+
+class StoredActions:
+    """Dict-like view of the per-action tallies of a single stored key"""
+
+    def __init__(self, store, slot):
+        self._store = store
+        self._slot = slot
+
+    def __getitem__(self, action):
+        """Returns the StoredTally for action"""
+        index = self._store.action_index(action)
+        return StoredTally(self._store,
+                           self._slot * len(self._store.actions) + index)
+
+    def __contains__(self, action):
+        return action in self._store.actions
+
+    def __iter__(self):
+        return iter(self._store.actions)
+
+    def __len__(self):
+        return len(self._store.actions)
+
+    def keys(self):
+        return self._store.actions
+
+    def items(self):
+        return [(action, self[action]) for action in self._store.actions]
+
+
+class ArrayOutcomeStore:
+    """Sparse outcome table backed by flat arrays instead of Python objects
+
+    State keys are hashed to 64-bit integers and placed in an open-addressing
+    table. Each slot holds the hashed key, a second independent hash of it
+    (see check_key) and a score sum and a count per action, so a key costs
+    a fixed 16 + 16 * len(actions) bytes no matter how large the state space
+    grows. Keys whose first hashes collide still get slots of their own,
+    and two keys are only merged if both 64-bit hashes collide. Key strings
+    are not kept: the store supports
+    membership tests and lookups but cannot list its keys, which is what
+    `ReinforcementLearner.ordered_keys` is for.
+
+    The store is a drop-in replacement for the outcomes dict of a
+    ReinforcementLearner:
+
+        rl = ReinforcementLearner(store=ArrayOutcomeStore())
+
+    When `path` is given the arrays live in a memory-mapped file rather than
+    in process memory, letting the operating system page them out.
+    """
+
+    LOAD_FACTOR = 0.5
+
+    def __init__(self, actions=('hit', 'stand'), capacity=1024, path=None):
+        """Creates an empty store
+
+        Args:
+            actions:    The actions tallied for every key
+            capacity:   Initial number of slots, rounded up to a power of two
+            path:       Optional file to memory-map the arrays into
+        """
+        self._actions = tuple(actions)
+        self._action_index = {a: i for i, a in enumerate(self._actions)}
+        self._path = path
+        self._file = None
+        self._buffer = None
+        self._size = 0
+
+        slots = 8
+        while slots < capacity:
+            slots *= 2
+        self._allocate(slots)
+
+    def __len__(self):
+        """Number of keys stored"""
+        return self._size
+
+    def __contains__(self, key):
+        """True if key has been initialized"""
+        return self._find(hash_key(key), check_key(key)) is not None
+
+    def __getitem__(self, key):
+        """Returns a dict-like view of the tallies for key
+
+        Raises:
+            KeyError: When key has not been initialized
+        """
+        slot = self._find(hash_key(key), check_key(key))
+        if slot is None:
+            raise KeyError(key)
+        return StoredActions(self, slot)
+
+    def __setitem__(self, key, tallies):
+        """Initializes key from a dict of action -> ScoreTally
+
+        Existing values for key are replaced. Actions missing from `tallies`
+        start empty. This keeps `ReinforcementLearner.init_prevstate` working
+        unchanged on top of the store.
+        """
+        slot = self._insert(hash_key(key), check_key(key))
+        base = slot * len(self._actions)
+        for action, index in self._action_index.items():
+            tally = tallies.get(action)
+            self._sums[base + index] = tally.total if tally else 0.0
+            self._counts[base + index] = tally.count if tally else 0
+
+    @property
+    def actions(self):
+        """The actions tallied for every key"""
+        return self._actions
+
+    def action_index(self, action):
+        """Position of action among the tallies of every key
+
+        Raises:
+            KeyError: When action is not tallied by the store
+        """
+        return self._action_index[action]
+
+    def tally_at(self, position):
+        """Returns the (score sum, count) of the tally at position
+
+        The tallies of the key in slot s take positions s * len(actions)
+        onwards, in the order of `actions`.
+        """
+        return (self._sums[position], self._counts[position])
+
+    def add_to_tally(self, position, score, count):
+        """Adds a score sum and count to the tally at position"""
+        self._sums[position] += score
+        self._counts[position] += count
+
+    @property
+    def capacity(self):
+        """Number of slots currently allocated"""
+        return len(self._keys)
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the slot arrays"""
+        return self.capacity * (16 + 16 * len(self._actions))
+
+    def memory_usage(self):
+        """Returns a dict describing the memory held by the store"""
+        return {
+            'keys': self._size,
+            'capacity': self.capacity,
+            'bytes': self.nbytes,
+            'resident': 0 if self._path else self.nbytes,
+            'mapped': self.nbytes if self._path else 0
+        }
+
+    def flush(self):
+        """Writes a memory-mapped store back to its file"""
+        if self._path:
+            self._buffer.flush()
+
+    def close(self):
+        """Releases the arrays and any backing file"""
+        if self._buffer is not None:
+            self._release()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _allocate(self, slots):
+        """Creates zeroed arrays for `slots` slots"""
+        width = len(self._actions)
+        nbytes = slots * (16 + 16 * width)
+
+        if self._path:
+            if self._file is None:
+                self._file = open(self._path, 'w+b')
+            self._file.truncate(0)
+            self._file.truncate(nbytes)
+            self._buffer = mmap.mmap(self._file.fileno(), nbytes)
+        else:
+            self._buffer = bytearray(nbytes)
+
+        view = memoryview(self._buffer)
+        checks_at = slots * 8
+        sums_at = checks_at + slots * 8
+        counts_at = sums_at + slots * width * 8
+        self._keys = view[:checks_at].cast('q')
+        self._checks = view[checks_at:sums_at].cast('q')
+        self._sums = view[sums_at:counts_at].cast('d')
+        self._counts = view[counts_at:].cast('q')
+
+    def _release(self):
+        """Drops the array views so the buffer can be resized or closed"""
+        for view in (self._keys, self._checks, self._sums, self._counts):
+            view.release()
+        if self._path:
+            self._buffer.close()
+        self._buffer = None
+
+    def _find(self, hashed, check):
+        """Returns the slot of the key with these hashes, or None"""
+        keys = self._keys
+        checks = self._checks
+        mask = len(keys) - 1
+        slot = hashed & mask
+        while True:
+            current = keys[slot]
+            if current == hashed and checks[slot] == check:
+                return slot
+            if current == 0:
+                return None
+            slot = (slot + 1) & mask
+
+    def _insert(self, hashed, check):
+        """Returns the slot of a key, claiming an empty one if needed"""
+        slot = self._find(hashed, check)
+        if slot is not None:
+            return slot
+
+        if (self._size + 1) > len(self._keys) * self.LOAD_FACTOR:
+            self._grow()
+
+        keys = self._keys
+        mask = len(keys) - 1
+        slot = hashed & mask
+        while keys[slot] != 0:
+            slot = (slot + 1) & mask
+        keys[slot] = hashed
+        self._checks[slot] = check
+        self._size += 1
+        return slot
+
+    def _grow(self):
+        """Doubles the capacity and rehashes every stored key"""
+        width = len(self._actions)
+        entries = []
+        for slot, hashed in enumerate(self._keys):
+            if hashed != 0:
+                base = slot * width
+                entries.append((hashed, self._checks[slot],
+                                self._sums[base:base + width].tolist(),
+                                self._counts[base:base + width].tolist()))
+
+        slots = len(self._keys) * 2
+        self._release()
+        self._allocate(slots)
+        self._size = 0
+
+        for hashed, check, sums, counts in entries:
+            base = self._insert(hashed, check) * width
+            for i in range(width):
+                self._sums[base + i] = sums[i]
+                self._counts[base + i] = counts[i]
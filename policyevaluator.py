@@ -0,0 +1,191 @@
+from fastengine import FastEngine, SequenceSource, seeded_values, state_key
+from ruleset import RuleSet
+from statistics import NormalDist
+import math
+
+
+def basic_strategy(total, soft, upcard):
+    """Hit/stand basic strategy for S17 games, without doubles or splits"""
+    if soft:
+        return 'hit' if total <= 17 or (total == 18 and upcard >= 9) \
+            else 'stand'
+    if total <= 11:
+        return 'hit'
+    if total == 12:
+        return 'stand' if 4 <= upcard <= 6 else 'hit'
+    if total <= 16:
+        return 'stand' if upcard <= 6 else 'hit'
+    return 'stand'
+
+
+def hit_below_17(total, soft, upcard):
+    """The rule of ConsolePlayer.singlerun: hit anything below 17"""
+    return 'hit' if total < 17 else 'stand'
+
+
+def basic_keys():
+    """Yields every hit/stand state key that can come up, as (key, total,
+    soft, upcard)"""
+    for soft, low in ((False, 4), (True, 12)):
+        for total in range(low, 22):
+            for upcard in range(2, 12):
+                yield state_key(total, soft, upcard), total, soft, upcard
+
+
+def policy_prior(policy, margin=0.05):
+    """Prior for ReinforcementLearner.warm_start from a hit/stand policy
+
+    A policy gives no values, so the chosen action is valued at 0 and the
+    other at -margin: enough to order the actions, small enough for a few
+    real hands to overturn.
+
+    Args:
+        policy: Function of (player_total, player_soft, dealer_upcard)
+                returning 'hit' or 'stand', eg: basic_strategy
+        margin: Value lead of the chosen action
+
+    Returns:
+        A dict of {key: {action: value}}
+    """
+    prior = {}
+    for key, total, soft, upcard in basic_keys():
+        chosen = policy(total, soft, upcard)
+        other = 'stand' if chosen == 'hit' else 'hit'
+        prior[key] = {chosen: 0.0, other: -margin}
+    return prior
+
+
+def learner_policy(learner, default=basic_strategy):
+    """Policy playing a learner's best action for each key
+
+    Args:
+        learner:    A ReinforcementLearner, ExtendedLearner or StrategyTable
+        default:    Policy for keys the learner has no action for
+    """
+    def policy(total, soft, upcard):
+        action = learner.action_for_key(state_key(total, soft, upcard))
+        if action not in ('hit', 'stand'):
+            return default(total, soft, upcard)
+        return action
+    return policy
+
+
+class PolicyEvaluator:
+    """Monte Carlo house edge of a fixed hit/stand policy
+
+    Hands are played through the FastEngine in batches, keeping running
+    sums of the scores overall and per starting state, and evaluation
+    stops as soon as the confidence interval is as narrow as requested.
+    No learner or state dicts are involved.
+
+        evaluator = PolicyEvaluator(basic_strategy, RuleSet(decks=6))
+        result = evaluator.evaluate(precision=0.005)
+        result['ev'], result['ci']
+    """
+
+    def __init__(self, policy, rules=None, engine=FastEngine, seed=None,
+                 batch=10000):
+        """Creates the evaluator
+
+        Args:
+            policy: Function of (player_total, player_soft, dealer_upcard)
+                    returning 'hit' or 'stand'
+            rules:  The RuleSet to play by, the defaults if None
+            engine: Engine class taking a card source and a RuleSet
+            seed:   Seed of the card sequence
+            batch:  Hands between precision checks
+        """
+        self.policy = policy
+        self.rules = rules if rules is not None else RuleSet()
+        self.batch = batch
+        source = SequenceSource(seeded_values(seed, self.rules.decks))
+        self._engine = engine(source, self.rules)
+        self._hands = 0
+        self._sum = 0.0
+        self._squares = 0.0
+        self._states = {}
+
+    def play(self, n):
+        """Plays n more hands, adding them to the running sums"""
+        play_hand = self._engine.play_hand
+        policy = self.policy
+        states = self._states
+        decisions = []
+        total = 0.0
+        squares = 0.0
+        for _ in range(n):
+            score = play_hand(policy, decisions)
+            # Naturals end the hand before any decision
+            start = decisions[0][0] if decisions else 'natural'
+            decisions.clear()
+            total += score
+            squares += score * score
+            sums = states.get(start)
+            if sums is None:
+                sums = states[start] = [0, 0.0, 0.0]
+            sums[0] += 1
+            sums[1] += score
+            sums[2] += score * score
+        self._hands += n
+        self._sum += total
+        self._squares += squares
+
+    def evaluate(self, max_hands=1000000, precision=None, confidence=0.95):
+        """Plays batches until the target precision or max_hands is reached
+
+        Hands already played by earlier calls count towards both.
+
+        Args:
+            max_hands:  Most hands to play in total
+            precision:  Target half-width of the EV confidence interval,
+                        None to always play max_hands
+            confidence: Confidence level of the intervals
+
+        Returns:
+            A dict with the hands played, the EV per hand, its standard
+            deviation, the confidence interval and its half-width, whether
+            the precision was reached, and 'by_state': a dict of starting
+            state key (or 'natural') to its hands, EV and half-width
+        """
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        while self._hands < max_hands:
+            self.play(min(self.batch, max_hands - self._hands))
+            if precision is not None and \
+                    self._half_width(self._hands, self._sum,
+                                     self._squares, z) <= precision:
+                break
+
+        ev = self._sum / self._hands if self._hands else 0.0
+        half_width = self._half_width(self._hands, self._sum,
+                                      self._squares, z)
+        by_state = {}
+        for key, (hands, total, squares) in self._states.items():
+            by_state[key] = {
+                'hands': hands,
+                'ev': total / hands,
+                'half_width': self._half_width(hands, total, squares, z)
+            }
+        return {
+            'hands': self._hands,
+            'ev': ev,
+            'stdev': self._stdev(self._hands, self._sum, self._squares),
+            'confidence': confidence,
+            'ci': (ev - half_width, ev + half_width),
+            'half_width': half_width,
+            'converged': precision is not None and half_width <= precision,
+            'by_state': by_state
+        }
+
+    @staticmethod
+    def _stdev(n, total, squares):
+        """Sample standard deviation from running sums"""
+        if n < 2:
+            return math.inf
+        return math.sqrt(max(0.0, (squares - total * total / n) / (n - 1)))
+
+    @classmethod
+    def _half_width(cls, n, total, squares, z):
+        """Half-width of the normal confidence interval of the mean"""
+        if n < 2:
+            return math.inf
+        return z * cls._stdev(n, total, squares) / math.sqrt(n)
@@ -1,5 +1,41 @@
-from blackjackgamerunner import BlackjackGameRunner
+from blackjackgame import BlackjackGame
+from blackjackgamerunner import BlackjackGameRunner, BlackjackTableRunner
+from array import array
+import json
+import math
+import os
 import random
+import signal
+import stateindex
+import sys
+import threading
+import time
+
+
+def ucb_choice(candidates, exploration, rng=random):
+    """Picks an action by the UCB1 rule
+
+    Untried actions come first. Otherwise the action with the highest
+    average plus `exploration * sqrt(ln(total count) / count)` is picked,
+    so actions are tried more while their estimates are close or backed by
+    few (real or prior) hands.
+
+    Args:
+        candidates:     List of (action, score sum, count) tuples
+        exploration:    Weight of the uncertainty bonus
+        rng:            random.Random choosing among untried actions, the
+                        random module by default
+    """
+    untried = [action for action, _, count in candidates if count <= 0]
+    if untried:
+        return rng.choice(untried)
+    log_total = math.log(sum(count for _, _, count in candidates))
+    best = None
+    for action, score, count in candidates:
+        bound = score / count + exploration * math.sqrt(log_total / count)
+        if best is None or bound > best[0]:
+            best = (bound, action)
+    return best[1]
 
 
 class ScoreTally:
@@ -54,6 +90,21 @@ class ScoreTally:
         self._score += score
         self._count += 1
 
+    def merge(self, score, count):
+        """Adds the total score and count of another tally"""
+        self._score += score
+        self._count += count
+
+    @property
+    def total(self):
+        """Sum of the tallied scores"""
+        return self._score
+
+    @property
+    def count(self):
+        """Number of tallied scores"""
+        return self._count
+
     @property
     def value(self):
         """Returns the average of the tallied scores"""
@@ -65,18 +116,164 @@ class ScoreTally:
 
 class ReinforcementLearner:
 
-    def __init__(self):
-        """Initializes the reinforcement learner"""
-        self.game = BlackjackGameRunner()
-        self._outcomes = {}
+    def __init__(self, track_count=False, store=None, rules=None,
+                 exploration=None, rng=None, naturals=False):
+        """Initializes the reinforcement learner
 
-    def run_explorer(self, n=1000):
+        Args:
+            track_count: When True state keys include the true count, so a
+                         count-indexed strategy is learned, eg: 'H16-10@+3'
+            store:       Container for the outcomes, such as an
+                         ArrayOutcomeStore, a plain dict is used if None
+            rules:       The RuleSet to learn under, the defaults if None
+            exploration: None for the uniformly random explorer, or the
+                         weight of the uncertainty bonus of ucb_choice to
+                         explore where the outcomes are least certain
+            rng:         random.Random for the explorer's choices and the
+                         shuffles, the random module if None
+            naturals:    When True blackjacks are settled on the deal, see
+                         BlackjackGame
+        """
+        self._random = rng if rng is not None else random
+        self.game = BlackjackGameRunner(
+            self._new_game(track_count, rules, naturals))
+        self._outcomes = store if store is not None else {}
+        self.exploration = exploration
+
+    def _new_game(self, track_count, rules, naturals):
+        """Creates the game the explorer plays"""
+        return BlackjackGame(track_count, rules=rules, naturals=naturals,
+                             rng=self._random)
+
+    # Most hands played between checks of the deadline and signals
+    CHUNK = 1000
+
+    def run_explorer(self, n=1000, tracker=None, seconds=None,
+                     handle_signals=False, save_path=None):
         """Runs the exploration responder
 
+        Hands are played in chunks, and between chunks the run ends early
+        once `seconds` have passed or a handled signal has arrived. What
+        was learned up to then is kept, so a run can be given a time slot
+        instead of a hand count.
+
         Args:
-            n: Number of iterations to run, default 1000
+            n:              Number of iterations to run, default 1000, a
+                            negative number to run until the time is up or
+                            a signal arrives, which needs `seconds` or
+                            `handle_signals`
+            tracker:        Optional ConvergenceTracker, a snapshot is
+                            taken every `tracker.interval` hands and after
+                            the last
+            seconds:        Wall-clock budget of the run, None for no limit
+            handle_signals: When True, SIGINT and SIGTERM end the run
+                            cleanly instead of interrupting or killing the
+                            process. Only possible in the main thread.
+            save_path:      Optional file that export_table is saved to
+                            when the run ends, however it ends
+
+        Returns:
+            A dict with the hands played, the seconds taken, the hands per
+            second and why the run 'stopped': 'complete', 'deadline' or the
+            name of the signal
+
+        Raises:
+            ValueError: If n is negative with neither a time budget nor
+                        signal handling, so the run could never stop, or if
+                        signals are to be handled outside the main thread
+        """
+        if n < 0 and seconds is None and not handle_signals:
+            raise ValueError("A run of unlimited hands needs seconds or "
+                             "handle_signals to stop")
+        if handle_signals and \
+                threading.current_thread() is not threading.main_thread():
+            raise ValueError("Signals can only be handled in the main "
+                             "thread")
+
+        start = time.monotonic()
+        deadline = start + seconds if seconds is not None else None
+        received = []
+        previous = {}
+        if handle_signals:
+            def stop(signum, frame):
+                received.append(signal.Signals(signum).name)
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous[signum] = signal.signal(signum, stop)
+
+        hands = 0
+        since_snapshot = 0
+        stopped = 'complete'
+        chunk = self.CHUNK
+        if tracker is not None:
+            chunk = min(chunk, tracker.interval)
+        try:
+            while n < 0 or hands < n:
+                if received:
+                    stopped = received[0]
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    stopped = 'deadline'
+                    break
+                size = chunk if n < 0 else min(chunk, n - hands)
+                if tracker is not None:
+                    size = min(size, tracker.interval - since_snapshot)
+                self.game.run(self.explorer, n=size)
+                hands += size
+                since_snapshot += size
+                if tracker is not None and \
+                        since_snapshot == tracker.interval:
+                    tracker.observe(self, since_snapshot)
+                    since_snapshot = 0
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            if tracker is not None and since_snapshot:
+                tracker.observe(self, since_snapshot)
+            if hasattr(self._outcomes, 'flush'):
+                self._outcomes.flush()
+            if save_path is not None:
+                self.save_table(save_path)
+
+        elapsed = time.monotonic() - start
+        return {
+            'hands': hands,
+            'seconds': elapsed,
+            'hands_per_second': hands / elapsed if elapsed else 0.0,
+            'stopped': stopped
+        }
+
+    def save_table(self, path):
+        """Writes export_table to a JSON file, replacing it atomically
+
+        The file can be read back with json.load for merge_table or
+        warm_start.
         """
-        self.game.run(self.explorer, n=n)
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, 'w') as f:
+                json.dump(self.export_table(), f)
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def run_table_explorer(self, n=1000, seats=5):
+        """Runs the exploration responder at every seat of a shared table
+
+        The dealer's hand is played once per round for all seats, so each
+        round yields `seats` hands for little more than the cost of one.
+
+        Args:
+            n:      Number of rounds to run, default 1000
+            seats:  Number of seats at the table, default 5
+        """
+        game = self.game.game
+        table = BlackjackTableRunner(seats, track_count=game.track_count,
+                                     extended=game.extended,
+                                     rules=game.rules,
+                                     naturals=game.naturals,
+                                     rng=self._random)
+        table.run(self.explorer, n=n)
 
     def init_prevstate(self, statestr):
         """Adds a new state key to the outcomes dict"""
@@ -90,6 +287,133 @@ class ReinforcementLearner:
         """Readonly access to the outcomes dict"""
         return self._outcomes
 
+    def memory_usage(self):
+        """Approximate number of bytes held by the outcomes
+
+        Stores that report their own usage (see ArrayOutcomeStore) are asked
+        directly, otherwise the dict, its keys and the tallies are measured.
+        """
+        if hasattr(self._outcomes, 'nbytes'):
+            return self._outcomes.nbytes
+
+        total = sys.getsizeof(self._outcomes)
+        for key, actions in self._outcomes.items():
+            total += sys.getsizeof(key) + sys.getsizeof(actions)
+            for tally in actions.values():
+                total += sys.getsizeof(tally) + sys.getsizeof(tally.__dict__)
+        return total
+
+    def record(self, key, action, score):
+        """Tallies the score of one decision made outside of the explorer
+
+        Args:
+            key:    State key, eg: 'H16-10'
+            action: The action taken
+            score:  Score credited to the decision
+        """
+        if key not in self._outcomes:
+            self.init_prevstate(key)
+        self._outcomes[key][action].tally(score)
+
+    def export_table(self):
+        """Returns the outcomes as plain data for serialization
+
+        Returns:
+            A dict of {key: {action: [score sum, count]}}, suitable for
+            json.dumps and for merge_table
+        """
+        if hasattr(self._outcomes, 'keys'):
+            keys = self._outcomes.keys()
+        else:
+            # Stores that cannot list their keys
+            keys = [k for k in self.ordered_keys() if k in self._outcomes]
+        table = {}
+        for key in keys:
+            table[key] = {action: [tally.total, tally.count]
+                          for action, tally in self._outcomes[key].items()}
+        return table
+
+    def merge_table(self, table):
+        """Adds the outcomes of an exported table to this learner's
+
+        Args:
+            table: A dict as returned by export_table
+        """
+        for key, actions in table.items():
+            if key not in self._outcomes:
+                self.init_prevstate(key)
+            tallies = self._outcomes[key]
+            for action, (score, count) in actions.items():
+                tallies[action].merge(score, count)
+
+    def warm_start(self, prior, weight=10, counts=range(-10, 11)):
+        """Seeds the outcomes with a prior worth `weight` hands per action
+
+        The prior is merged as pseudo-counts, so estimates start at the
+        prior's values and move away from them as real hands are tallied.
+
+        Args:
+            prior:  A dict of {key: {action: value}}, eg: from policy_prior
+                    or CompositionSolver.prior, or a table of {key: {action:
+                    [score sum, count]}} exported by a previous run. An
+                    exported action counts for its own count when that is
+                    below `weight`, so what the earlier run barely explored
+                    stays uncertain.
+            weight: Pseudo-count of each prior value
+            counts: True counts a key without a count is seeded at when the
+                    learner tracks the count, eg: 'H16-10' seeds
+                    'H16-10@-10' through 'H16-10@+10'. Keys that carry a
+                    count are seeded as they are.
+        """
+        if self.game.game.track_count:
+            prior = self._counted_prior(prior, counts)
+        table = {}
+        for key, actions in prior.items():
+            for action, value in actions.items():
+                count = weight
+                if isinstance(value, (list, tuple)):
+                    score, count = value
+                    value = score / count if count else 0.0
+                    count = min(count, weight)
+                if count > 0:
+                    table.setdefault(key, {})[action] = [value * count, count]
+        self.merge_table(table)
+
+    @staticmethod
+    def _counted_prior(prior, counts):
+        """Copies the prior of every key without a count to each count
+
+        Keys of the prior that already carry a count take precedence over
+        the copies.
+        """
+        counted = {}
+        for key, actions in prior.items():
+            if '@' not in key:
+                for count in counts:
+                    counted[f"{key}@{count:+d}"] = actions
+        counted.update((key, actions) for key, actions in prior.items()
+                       if '@' in key)
+        return counted
+
+    def state_key(self, state):
+        """Key of an active state, as BlackjackGame.prevstate_tup makes it"""
+        key = (f"{'S' if state['player_soft'] else 'H'}"
+               f"{state['player_total']}-{state['dealer_upcard']}")
+        if 'true_count' in state:
+            key = f"{key}@{state['true_count']:+d}"
+        return key
+
+    def _explore(self, state):
+        """Chooses hit or stand by ucb_choice over the tallies of the state"""
+        key = self.state_key(state)
+        if key not in self._outcomes:
+            return self._random.choice(('hit', 'stand'))
+        tallies = self._outcomes[key]
+        return ucb_choice([(action, tallies[action].total,
+                            tallies[action].count)
+                           for action in ('hit', 'stand')], self.exploration,
+                          self._random)
+
     def explorer(self, state):
         """Responder function that randomly chooses hit or stand
         Also tracks the score in self.outcomes
@@ -98,13 +422,19 @@ class ReinforcementLearner:
             state: A state dict from a BlackjackGame instance
         """
         prevstate = state['prevstate']
+        if prevstate is None and not state['active']:
+            # Naturals end the hand before the player makes a decision
+            return None
+
         if state['active']:
             if prevstate is not None:
                 if prevstate[0] not in self.outcomes:
                     self.init_prevstate(prevstate[0])
                 self.outcomes[prevstate[0]][prevstate[1]].tally(0.1)
 
-            if random.randint(0, 1):
+            if self.exploration is not None:
+                return self._explore(state)
+            if self._random.randint(0, 1):
                 return 'hit'
             else:
                 return 'stand'
@@ -160,3 +490,180 @@ class ReinforcementLearner:
         else:
             diff = actions['stand'] - actions['hit']
             return f"Stand +{diff}"
+
+
+class ExtendedLearner(ReinforcementLearner):
+    """Explorer over hit, stand, double, split and surrender
+
+    Rather than string keys and ScoreTally objects, outcomes are tallied in
+    two flat arrays indexed by `stateindex.encode(...) * len(ACTIONS) +
+    action id`. Memory is fixed at creation no matter how many extended
+    states are visited, and recording a decision is two array updates.
+    """
+
+    def __init__(self, track_count=False, rules=None, exploration=None,
+                 rng=None, naturals=False):
+        """Initializes the learner and its outcome arrays
+
+        See ReinforcementLearner for the arguments.
+
+        Raises:
+            ValueError: If track_count is True, the state index has no
+                        count so a count-indexed strategy cannot be learned
+        """
+        if track_count:
+            raise ValueError("ExtendedLearner states do not include the "
+                             "count, use ReinforcementLearner")
+        super().__init__(track_count, rules=rules, exploration=exploration,
+                         rng=rng, naturals=naturals)
+        width = stateindex.SIZE * len(stateindex.ACTIONS)
+        self._sums = array('d', bytes(8 * width))
+        self._counts = array('q', bytes(8 * width))
+
+    def _new_game(self, track_count, rules, naturals):
+        """Creates the extended game the explorer plays"""
+        return BlackjackGame(track_count, extended=True, rules=rules,
+                             naturals=naturals, rng=self._random)
+
+    def _tally(self, previndex, score):
+        """Adds a score for a (state index, action id) pair"""
+        position = previndex[0] * len(stateindex.ACTIONS) + previndex[1]
+        self._sums[position] += score
+        self._counts[position] += 1
+
+    def explorer(self, state):
+        """Responder function choosing randomly among the allowed actions
+        Also tallies the results in the outcome arrays
+
+        Args:
+            state: A state dict from a BlackjackGame instance
+        """
+        if state['active']:
+            if state['prevstate_index'] is not None:
+                self._tally(state['prevstate_index'], 0.1)
+            if self.exploration is not None:
+                return self._explore(state)
+            return self._random.choice(state['actions'])
+        else:
+            for _, previndex, score in state['results']:
+                self._tally(previndex, score)
+            return None
+
+    def _explore(self, state):
+        """Chooses among the allowed actions by ucb_choice"""
+        base = state['state_index'] * len(stateindex.ACTIONS)
+        candidates = []
+        for action in state['actions']:
+            position = base + stateindex.ACTION_IDS[action]
+            candidates.append((action, self._sums[position],
+                               self._counts[position]))
+        return ucb_choice(candidates, self.exploration, self._random)
+
+    def record(self, key, action, score):
+        """Tallies the score of one decision, see index_for_key for keys"""
+        self._tally((self.index_for_key(key), stateindex.ACTION_IDS[action]),
+                    score)
+
+    def export_table(self):
+        """Returns the visited outcomes as plain data for serialization
+
+        Returns:
+            A dict of {str(state index): {action: [score sum, count]}} with
+            only the actions that were taken, see merge_table
+        """
+        table = {}
+        width = len(stateindex.ACTIONS)
+        for position, count in enumerate(self._counts):
+            if count:
+                index, action = divmod(position, width)
+                table.setdefault(str(index), {})[
+                    stateindex.ACTIONS[action]] = [self._sums[position], count]
+        return table
+
+    def merge_table(self, table):
+        """Adds the outcomes of an exported table to this learner's"""
+        width = len(stateindex.ACTIONS)
+        for index, actions in table.items():
+            for action, (score, count) in actions.items():
+                position = self.index_for_key(index) * width + \
+                    stateindex.ACTION_IDS[action]
+                self._sums[position] += score
+                self._counts[position] += count
+
+    def memory_usage(self):
+        """Number of bytes held by the outcome arrays"""
+        return (self._sums.itemsize * len(self._sums)
+                + self._counts.itemsize * len(self._counts))
+
+    @staticmethod
+    def index_for_key(key):
+        """Converts a key such as 'H16-10' or a state index to an index
+
+        String keys are taken as the most common extended state for each
+        key: a two-card hand that is not a pair and may double. Totals only
+        a pair can make on two cards (hard 4 and 20, soft 12) are the pair,
+        which may double and split, and totals no two cards make (hard 21,
+        soft 21 being a natural) are a hand of more cards. Strings of
+        digits, as in exported tables, are state indexes.
+        """
+        if isinstance(key, int):
+            return key
+        if key.isdigit():
+            return int(key)
+        total, upcard = key[1:].split('-')
+        total = int(total)
+        soft = key[0] == 'S'
+        if soft:
+            pair = 1 if total == 12 else 0
+            two_cards = 13 <= total <= 20
+        else:
+            pair = total // 2 if total in (4, 20) else 0
+            two_cards = 5 <= total <= 19
+        if pair:
+            return stateindex.encode(total, soft, int(upcard), pair,
+                                     can_double=True, can_split=True)
+        return stateindex.encode(total, soft, int(upcard),
+                                 can_double=two_cards)
+
+    def count(self, key, action):
+        """Number of times action was tallied for key"""
+        index = self.index_for_key(key)
+        position = index * len(stateindex.ACTIONS) + \
+            stateindex.ACTION_IDS[action]
+        return self._counts[position]
+
+    def value(self, key, action):
+        """Average score of action for key, None if never taken"""
+        index = self.index_for_key(key)
+        position = index * len(stateindex.ACTIONS) + \
+            stateindex.ACTION_IDS[action]
+        if self._counts[position] == 0:
+            return None
+        return self._sums[position] / self._counts[position]
+
+    def ranked_actions(self, key):
+        """List of (average score, action) for key, best first"""
+        ranked = []
+        for action in stateindex.ACTIONS:
+            value = self.value(key, action)
+            if value is not None:
+                ranked.append((value, action))
+        ranked.sort(reverse=True)
+        return ranked
+
+    def action_for_key(self, key):
+        """Returns the action with the highest average score"""
+        ranked = self.ranked_actions(key)
+        if not ranked:
+            return None
+        return ranked[0][1]
+
+    def action_with_diff(self, key):
+        """Returns a string with the best action and its lead over the next"""
+        ranked = self.ranked_actions(key)
+        if not ranked:
+            return None
+        if len(ranked) == 1:
+            return ranked[0][1].capitalize()
+        diff = ranked[0][0] - ranked[1][0]
+        return f"{ranked[0][1].capitalize()} +{diff}"
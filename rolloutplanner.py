@@ -0,0 +1,209 @@
+from array import array
+from policyevaluator import basic_strategy
+import random
+import time
+
+# Card values of one deck, drawn with replacement for an infinite deck
+ONE_DECK = [min(v, 10) for v in range(1, 14)] * 4
+
+
+class RolloutPlanner:
+    """Responder choosing hit or stand by Monte Carlo rollouts
+
+    At each decision a GameSnapshot of the game is taken and `rollouts`
+    random continuations are played from it, dealing from the cards the
+    player has not seen. Each rollout plays both stand and hit, the hit
+    then continuing with `policy`, on the same random cards, so the
+    difference between the two has far less noise than two independent
+    estimates. The better action is returned.
+
+    Rollouts deal from the snapshot's pool of unseen card values by a
+    partial Fisher-Yates shuffle, which only permutes it, so nothing is
+    copied between rollouts. The swaps are undone once the decision is
+    made, leaving the snapshot as it was. When the unseen cards run out,
+    the rollout goes on from a fresh shoe as the game would.
+
+        game = BlackjackGame(rules=RuleSet(decks=1, penetration=0.75),
+                             naturals=True)
+        planner = RolloutPlanner(game, rollouts=100)
+        BlackjackGameRunner(game).run(planner.respond, n=1000)
+    """
+
+    def __init__(self, game, rollouts=100, policy=basic_strategy, seed=None):
+        """Creates the planner
+
+        Args:
+            game:       The BlackjackGame the planner responds for
+            rollouts:   Rollouts per decision, each playing both actions
+            policy:     Function of (player_total, player_soft,
+                        dealer_upcard) returning 'hit' or 'stand', played
+                        after the first hit of a rollout
+            seed:       Seed of the rollouts
+        """
+        if rollouts < 1:
+            raise ValueError("At least one rollout is needed per decision")
+        self.game = game
+        self.rollouts = rollouts
+        self.policy = policy
+        self._rng = random.Random(seed)
+        # The shoe the game starts once the current one runs out
+        self._fresh = array('b', ONE_DECK) * game.rules.decks
+        self._decisions = 0
+        self._seconds = 0.0
+
+    def respond(self, state):
+        """Responder function for BlackjackGameRunner.run"""
+        if not state['active']:
+            return None
+        start = time.perf_counter()
+        values = self.evaluate(self.game.snapshot())
+        self._seconds += time.perf_counter() - start
+        self._decisions += 1
+        return 'hit' if values['hit'] > values['stand'] else 'stand'
+
+    def evaluate(self, snapshot, rollouts=None):
+        """Estimates the value of hitting and standing from a snapshot
+
+        Cards beyond the unseen ones are dealt from a fresh shoe of the
+        game's rules, as BlackjackGame.safe_draw would.
+
+        Args:
+            snapshot:   GameSnapshot of the hand to decide
+            rollouts:   Rollouts to play, self.rollouts if None
+
+        Returns:
+            A dict of the mean score of 'hit' and of 'stand'
+        """
+        rollouts = rollouts or self.rollouts
+        rnd = self._rng.random
+        rules = self.game.rules
+        must_hit = rules.dealer_must_hit
+        policy = self.policy
+
+        infinite = snapshot.infinite
+        if infinite:
+            pool = []
+            size = 0
+        else:
+            pool = snapshot.pool
+            size = len(pool)
+        fresh = self._fresh
+        fresh_size = len(fresh)
+        # Cards of an infinite deck, drawn with replacement, kept to be
+        # dealt again
+        extra = []
+        # (cards, i, j) of every swap, undone in reverse at the end
+        swaps = []
+        # [cards drawn in this rollout, cards already chosen in it]
+        cursor = [0, 0]
+
+        def draw():
+            """Next card of the rollout, the same ones again after a rewind"""
+            i = cursor[0]
+            cursor[0] = i + 1
+            if infinite:
+                if i < cursor[1]:
+                    return extra[i]
+                cursor[1] = i + 1
+                card = ONE_DECK[int(rnd() * 52)]
+                if i < len(extra):
+                    extra[i] = card
+                else:
+                    extra.append(card)
+                return card
+            if i < cursor[1]:
+                return pool[i] if i < size else fresh[i - size]
+            cursor[1] = i + 1
+            if i < size:
+                cards, n = pool, size
+            else:
+                cards, n = fresh, fresh_size
+                i -= size
+            j = i + int(rnd() * (n - i))
+            card = cards[j]
+            if j != i:
+                cards[j] = cards[i]
+                cards[i] = card
+                swaps.append((cards, i, j))
+            return card
+
+        def dealer(hard, ace):
+            """Dealer's final total, drawing from the rollout"""
+            soft = ace and hard <= 11
+            total = hard + 10 if soft else hard
+            while must_hit(total, soft):
+                card = draw()
+                hard += card
+                ace = ace or card == 1
+                soft = ace and hard <= 11
+                total = hard + 10 if soft else hard
+            return total
+
+        def score(total, dealer_total):
+            if dealer_total > 21 or total > dealer_total:
+                return 1
+            return 0 if total == dealer_total else -1
+
+        upcard = snapshot.upcard
+        naturals = snapshot.naturals
+        shown = 11 if upcard == 1 else upcard
+        # Hole cards the dealer's peek has ruled out
+        excluded = 0
+        if snapshot.peeked:
+            excluded = {1: 10, 10: 1}.get(upcard, 0)
+            if excluded and snapshot.composition[excluded - 1] == size:
+                # Only excluded cards are left, the shoe runs out anyway
+                excluded = 0
+        stand_total = snapshot.player_total
+        player_hard = snapshot.player_hard
+        player_ace = snapshot.player_ace
+
+        hit_sum = 0
+        stand_sum = 0
+        for _ in range(rollouts):
+            cursor[0] = cursor[1] = 0
+            hole = draw()
+            while hole == excluded:
+                # Put the card back and deal the hole card again
+                cursor[0] = cursor[1] = 0
+                hole = draw()
+            dealer_hard = upcard + hole
+            dealer_ace = upcard == 1 or hole == 1
+            if naturals and dealer_ace and dealer_hard == 11:
+                # A dealer blackjack the peek has not ruled out takes all
+                hit_sum -= 1
+                stand_sum -= 1
+                continue
+            after_hole = cursor[0]
+
+            stand_sum += score(stand_total, dealer(dealer_hard, dealer_ace))
+
+            cursor[0] = after_hole
+            hard = player_hard
+            ace = player_ace
+            while True:
+                card = draw()
+                hard += card
+                ace = ace or card == 1
+                if hard > 21:
+                    hit_sum -= 1
+                    break
+                soft = ace and hard <= 11
+                total = hard + 10 if soft else hard
+                if policy(total, soft, shown) != 'hit':
+                    hit_sum += score(total, dealer(dealer_hard, dealer_ace))
+                    break
+
+        for cards, i, j in reversed(swaps):
+            cards[i], cards[j] = cards[j], cards[i]
+        return {'hit': hit_sum / rollouts, 'stand': stand_sum / rollouts}
+
+    def stats(self):
+        """Returns the decisions made and the time they took"""
+        return {
+            'decisions': self._decisions,
+            'rollouts': self._decisions * self.rollouts,
+            'seconds': self._seconds,
+            'us_per_decision': 1e6 * self._seconds / self._decisions
+            if self._decisions else 0.0
+        }
@@ -0,0 +1,251 @@
+from deck import Deck, InfiniteDeck, HI_LO
+import hashlib
+
+
+class RuleSet:
+    """The table rules a game is played under
+
+    Rule sets are readonly and compare equal when all of their rules
+    match. `key` is a stable hash of the rules, used to cache tables that
+    only depend on the rules (see TableCache).
+    """
+
+    FIELDS = ('hit_soft_17', 'blackjack_payout', 'dealer_peek', 'decks',
+              'penetration', 'max_split_hands', 'double_after_split',
+              'surrender')
+
+    def __init__(self, hit_soft_17=False, blackjack_payout=1.5,
+                 dealer_peek=True, decks=1, penetration=1.0,
+                 max_split_hands=4, double_after_split=True, surrender=True):
+        """Creates a rule set, the defaults are a single deck S17 3:2 game
+
+        Args:
+            hit_soft_17:        True if the dealer hits soft 17 (H17)
+            blackjack_payout:   Payout of a player blackjack, 1.5 for 3:2 or
+                                1.2 for 6:5
+            dealer_peek:        True if the dealer checks for blackjack with
+                                an Ace or ten up before the player acts
+            decks:              Number of 52-card decks in the shoe, 0 for
+                                an infinite deck (see InfiniteDeck)
+            penetration:        Fraction of the shoe dealt before it is
+                                reshuffled at the start of a hand
+            max_split_hands:    Most hands a player may hold after re-splits
+            double_after_split: True if split hands may double
+            surrender:          True if late surrender is offered
+
+        Raises:
+            ValueError: For rules that cannot be played
+        """
+        if decks < 0:
+            raise ValueError("A shoe cannot have fewer than 0 decks")
+        if not 0 < penetration <= 1:
+            raise ValueError("Penetration must be in (0, 1]")
+        if max_split_hands < 1:
+            raise ValueError("max_split_hands must be at least 1")
+
+        self._hit_soft_17 = bool(hit_soft_17)
+        self._blackjack_payout = float(blackjack_payout)
+        self._dealer_peek = bool(dealer_peek)
+        self._decks = int(decks)
+        self._penetration = float(penetration)
+        self._max_split_hands = int(max_split_hands)
+        self._double_after_split = bool(double_after_split)
+        self._surrender = bool(surrender)
+
+        text = repr(sorted(self.as_dict().items()))
+        self._key = hashlib.sha256(text.encode()).hexdigest()[:16]
+
+    def __repr__(self):
+        fields = ', '.join(f"{f}={v!r}" for f, v in self.as_dict().items())
+        return f"RuleSet({fields})"
+
+    def __eq__(self, other):
+        return isinstance(other, RuleSet) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    @property
+    def hit_soft_17(self):
+        """True if the dealer hits soft 17"""
+        return self._hit_soft_17
+
+    @property
+    def blackjack_payout(self):
+        """Payout of a player blackjack, eg: 1.5 for 3:2"""
+        return self._blackjack_payout
+
+    @property
+    def dealer_peek(self):
+        """True if the dealer checks for blackjack before the player acts"""
+        return self._dealer_peek
+
+    @property
+    def decks(self):
+        """Number of decks in the shoe, 0 for an infinite deck"""
+        return self._decks
+
+    @property
+    def infinite(self):
+        """True if cards are drawn from an infinite deck"""
+        return self._decks == 0
+
+    @property
+    def penetration(self):
+        """Fraction of the shoe dealt before reshuffling"""
+        return self._penetration
+
+    @property
+    def max_split_hands(self):
+        """Most hands a player may hold after re-splitting"""
+        return self._max_split_hands
+
+    @property
+    def double_after_split(self):
+        """True if split hands may double"""
+        return self._double_after_split
+
+    @property
+    def surrender(self):
+        """True if late surrender is offered"""
+        return self._surrender
+
+    @property
+    def key(self):
+        """Stable hash of the rules, the same in every process"""
+        return self._key
+
+    def as_dict(self):
+        """The rules as a dict of keyword arguments for RuleSet"""
+        return {field: getattr(self, field) for field in RuleSet.FIELDS}
+
+    def replace(self, **changes):
+        """Returns a copy of the rule set with some rules changed"""
+        rules = self.as_dict()
+        rules.update(changes)
+        return RuleSet(**rules)
+
+    def dealer_must_hit(self, total, soft):
+        """True if the dealer has to hit the given total"""
+        return total < 17 or (total == 17 and soft and self.hit_soft_17)
+
+    def new_deck(self, tags=HI_LO, rng=None):
+        """Creates and shuffles a shoe of the configured size
+
+        Args:
+            tags:   Tag system of the shoe's count
+            rng:    random.Random the shoe is shuffled or seeded from, the
+                    random module if None
+        """
+        if self.infinite:
+            return InfiniteDeck(tags, rng=rng)
+        deck = Deck(tags, self.decks)
+        deck.shuffle(rng)
+        return deck
+
+    def needs_shuffle(self, deck):
+        """True once the shoe has been dealt past the penetration"""
+        if self.infinite:
+            return False
+        return len(deck) < 52 * self.decks * (1 - self.penetration)
+
+
+class TableCache:
+    """Cache of precomputed tables shared between games with equal rules
+
+    Tables are keyed by the rule set's key and a table name, so any number
+    of games, learners or solvers playing under the same rules compute each
+    table once.
+    """
+
+    def __init__(self):
+        """Creates an empty cache"""
+        self._tables = {}
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        """Number of cached tables"""
+        return len(self._tables)
+
+    def get(self, rules, name, compute):
+        """Returns a cached table, computing it on the first request
+
+        Args:
+            rules:      The RuleSet the table depends on
+            name:       Any hashable name of the table
+            compute:    Function of rules returning the table
+        """
+        key = (rules.key, name)
+        try:
+            table = self._tables[key]
+        except KeyError:
+            self._misses += 1
+            table = self._tables[key] = compute(rules)
+        else:
+            self._hits += 1
+        return table
+
+    def clear(self):
+        """Removes all tables"""
+        self._tables.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self):
+        """Returns a dict of hit/miss statistics"""
+        return {'hits': self._hits, 'misses': self._misses,
+                'size': len(self._tables)}
+
+
+tables = TableCache()
+
+# Infinite deck probability of drawing each value, Ace first
+VALUE_PROBABILITIES = (1 / 13,) * 9 + (4 / 13,)
+
+
+def dealer_probabilities(rules, upcard):
+    """Infinite deck distribution of the dealer's final total
+
+    The result is cached per rule set in `tables`. When the dealer peeks,
+    the distribution is conditioned on the dealer not having a blackjack.
+
+    Args:
+        rules:  The RuleSet to play the dealer's hand under
+        upcard: Dealer upcard, 2 through 11
+
+    Returns:
+        A tuple of probabilities for final totals 17, 18, 19, 20, 21, bust
+    """
+    return tables.get(rules, ('dealer', upcard),
+                      lambda r: _dealer_distribution(r, upcard))
+
+
+def _dealer_distribution(rules, upcard):
+    """Computes dealer_probabilities without caching"""
+    def draw_out(hard, ace, cards):
+        soft = ace and hard <= 11
+        total = hard + 10 if soft else hard
+        if total > 21:
+            return (0, 0, 0, 0, 0, 1)
+        if not rules.dealer_must_hit(total, soft):
+            result = [0] * 6
+            result[total - 17] = 1
+            return tuple(result)
+
+        probs = [0.0] * 6
+        for index, p in enumerate(VALUE_PROBABILITIES):
+            value = index + 1
+            # With peek, the hole card cannot complete a blackjack
+            if cards == 1 and rules.dealer_peek and hard + value == 11 \
+                    and (ace or value == 1):
+                continue
+            sub = draw_out(hard + value, ace or value == 1, cards + 1)
+            for i in range(6):
+                probs[i] += p * sub[i]
+        return probs
+
+    value = 1 if upcard == 11 else upcard
+    probs = draw_out(value, value == 1, 1)
+    norm = sum(probs)
+    return tuple(p / norm for p in probs)
@@ -0,0 +1,301 @@
+from reinforcementlearner import ReinforcementLearner
+from ruleset import RuleSet
+from collections import deque
+import json
+import random
+import socket
+import socketserver
+import sys
+import threading
+
+
+def send_message(wfile, message):
+    """Writes a message as a single compact line of JSON"""
+    data = json.dumps(message, separators=(',', ':')).encode() + b'\n'
+    wfile.write(data)
+    wfile.flush()
+
+
+def read_message(rfile):
+    """Reads one line of JSON
+
+    Raises:
+        ConnectionError: If the other side closed the connection
+    """
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    return json.loads(line)
+
+
+def work_units(hands, unit_hands, seed=0):
+    """Splits a run of hands into (seed, hands) work units
+
+    Args:
+        hands:      Total number of hands to play
+        unit_hands: Most hands in a single unit
+        seed:       Seed of the first unit, later units count up from it
+
+    Returns:
+        A list of (seed, hands) tuples
+    """
+    units = []
+    while hands > 0:
+        n = min(unit_hands, hands)
+        units.append((seed + len(units), n))
+        hands -= n
+    return units
+
+
+def simulate_unit(seed, hands, track_count=False, rules=None,
+                  naturals=False):
+    """Plays one work unit with a fresh learner and exports its outcomes
+
+    The same arguments always give the same table, whichever process the
+    unit runs in. The unit draws from its own random.Random, so the random
+    module's state is left alone.
+
+    Args:
+        seed:           Seed of the unit
+        hands:          Number of hands to explore
+        track_count:    See ReinforcementLearner
+        rules:          Dict of RuleSet arguments, the defaults if None
+        naturals:       See ReinforcementLearner
+
+    Returns:
+        The learner's outcomes as returned by export_table
+    """
+    learner = ReinforcementLearner(track_count, rules=RuleSet(**rules or {}),
+                                   rng=random.Random(seed),
+                                   naturals=naturals)
+    learner.run_explorer(n=hands)
+    return learner.export_table()
+
+
+class SimulationCoordinator:
+    """Hands out explorer work units to workers over TCP
+
+    Each worker connection is served by its own thread. A worker is sent a
+    (seed, hands) unit, plays it with simulate_unit and replies with the
+    exported outcome table, which is merged into the coordinator's learner
+    straight away. If a worker disconnects, times out or sends garbage, its
+    unit is put back in the queue for another worker, and nothing of a
+    malformed table is merged. Results for a unit that has already been
+    merged are dropped, so a requeued unit is never counted twice.
+
+        coordinator = SimulationCoordinator(learner, work_units(10**6, 10**4))
+        host, port = coordinator.start()
+        # start SimulationWorker(host, port).run() on any number of nodes
+        coordinator.wait()
+        coordinator.stop()
+
+    Messages are single lines of JSON, see send_message.
+    """
+
+    def __init__(self, learner, units, host='127.0.0.1', port=0,
+                 timeout=60.0):
+        """Creates the coordinator, call start to begin serving
+
+        Args:
+            learner:    ReinforcementLearner the results are merged into,
+                        its track_count, rules and naturals are passed to
+                        the workers
+            units:      List of (seed, hands) work units, see work_units
+            host:       Address to listen on
+            port:       Port to listen on, 0 picks a free port
+            timeout:    Seconds to wait on a worker before requeuing its unit
+        """
+        self.learner = learner
+        game = learner.game.game
+        self._config = {'track_count': game.track_count,
+                        'rules': game.rules.as_dict(),
+                        'naturals': game.naturals}
+        self._timeout = timeout
+
+        self._pending = deque(enumerate(units))
+        self._total = len(self._pending)
+        self._completed = set()
+        self._requeued = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+
+        self._server = _CoordinatorServer((host, port), _WorkerHandler)
+        self._server.coordinator = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """The (host, port) workers connect to"""
+        return self._server.server_address[:2]
+
+    @property
+    def timeout(self):
+        """Seconds to wait on a worker before requeuing its unit"""
+        return self._timeout
+
+    @property
+    def worker_config(self):
+        """Learner settings sent to the workers with every unit"""
+        return dict(self._config)
+
+    @property
+    def finished(self):
+        """True once every unit has been merged"""
+        with self._condition:
+            return len(self._completed) == self._total
+
+    def stats(self):
+        """Returns a dict of unit counts"""
+        with self._condition:
+            return {'units': self._total,
+                    'completed': len(self._completed),
+                    'pending': len(self._pending),
+                    'requeued': self._requeued}
+
+    def start(self):
+        """Starts serving workers in a background thread
+
+        Returns:
+            The (host, port) address workers connect to
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self.address
+
+    def wait(self, timeout=None):
+        """Blocks until every unit is merged or the timeout passes
+
+        Returns:
+            True if every unit was merged
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: len(self._completed) == self._total, timeout)
+
+    def stop(self):
+        """Stops serving and releases any waiting workers"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def next_unit(self):
+        """Takes a unit off the queue, None once there is nothing left
+
+        Idle workers wait here while units are still out with other workers,
+        in case one of them is lost and its unit requeued.
+        """
+        with self._condition:
+            while not self._pending:
+                if self._stopping or len(self._completed) == self._total:
+                    return None
+                self._condition.wait()
+            return self._pending.popleft()
+
+    def complete(self, unit, table):
+        """Merges the table of a finished unit
+
+        The table is first merged into a scratch learner, so a malformed
+        one raises before any of it reaches the coordinator's learner and
+        the unit can be requeued without counting anything twice.
+
+        Raises:
+            KeyError, TypeError, ValueError: When the table is malformed
+        """
+        scratch = ReinforcementLearner(rng=random.Random(0))
+        scratch.merge_table(table)
+        with self._condition:
+            if unit[0] not in self._completed:
+                self.learner.merge_table(scratch.export_table())
+                self._completed.add(unit[0])
+            self._condition.notify_all()
+
+    def requeue(self, unit):
+        """Puts the unit of a lost worker back in the queue"""
+        with self._condition:
+            if unit[0] not in self._completed:
+                self._pending.append(unit)
+                self._requeued += 1
+            self._condition.notify_all()
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Serves one worker connection for SimulationCoordinator"""
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        self.request.settimeout(coordinator.timeout)
+        unit = None
+        try:
+            read_message(self.rfile)
+            while True:
+                unit = coordinator.next_unit()
+                if unit is None:
+                    send_message(self.wfile, {'type': 'done'})
+                    return
+                unit_id, (seed, hands) = unit
+                send_message(self.wfile, {'type': 'work', 'unit': unit_id,
+                                          'seed': seed, 'hands': hands,
+                                          **coordinator.worker_config})
+                reply = read_message(self.rfile)
+                if reply.get('unit') != unit_id:
+                    raise ValueError("Result for the wrong unit")
+                coordinator.complete(unit, reply['table'])
+                unit = None
+        except (OSError, ValueError, KeyError, TypeError):
+            # Lost or misbehaving worker, its unit goes to someone else
+            pass
+        finally:
+            if unit is not None:
+                coordinator.requeue(unit)
+
+
+class SimulationWorker:
+    """Plays work units for a SimulationCoordinator until it is done"""
+
+    def __init__(self, host, port):
+        """Creates a worker for the coordinator at (host, port)"""
+        self.address = (host, port)
+
+    def run(self):
+        """Connects and plays units until the coordinator has no more
+
+        Returns:
+            Number of units played
+        """
+        played = 0
+        with socket.create_connection(self.address) as sock:
+            rfile = sock.makefile('rb')
+            wfile = sock.makefile('wb')
+            send_message(wfile, {'type': 'hello'})
+            while True:
+                message = read_message(rfile)
+                if message['type'] == 'done':
+                    return played
+                table = simulate_unit(message['seed'], message['hands'],
+                                      message['track_count'],
+                                      message['rules'],
+                                      message.get('naturals', False))
+                send_message(wfile, {'type': 'result',
+                                     'unit': message['unit'],
+                                     'table': table})
+                played += 1
+
+
+def run_worker(host, port):
+    """Runs a SimulationWorker, usable as a multiprocessing target"""
+    return SimulationWorker(host, port).run()
+
+
+if __name__ == "__main__":
+    # python simulationcoordinator.py HOST PORT starts a worker
+    run_worker(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,60 @@
+"""Dense integer indexing of extended player states
+
+An extended state is the player's total and softness, the dealer's upcard,
+the value of a splittable pair (0 when the hand is not a pair) and whether
+doubling and splitting are allowed. Each combination maps to a unique
+integer in range(SIZE), so outcomes can be kept in flat arrays of
+SIZE * len(ACTIONS) entries instead of growing string-keyed dicts.
+"""
+
+ACTIONS = ('hit', 'stand', 'double', 'split', 'surrender')
+ACTION_IDS = {action: i for i, action in enumerate(ACTIONS)}
+
+TOTALS = 18     # 4 through 21
+UPCARDS = 10    # 2 through 11
+PAIRS = 11      # 0 for no pair, otherwise the pair's value 1 through 10
+
+SIZE = 2 * TOTALS * UPCARDS * PAIRS * 2 * 2
+
+
+def encode(total, soft, upcard, pair=0, can_double=False, can_split=False):
+    """Returns the index of an extended state
+
+    Args:
+        total:      Player total, 4 through 21
+        soft:       True for soft totals
+        upcard:     Dealer upcard, 2 through 11
+        pair:       Value of the player's pair, 0 if not a pair
+        can_double: True if doubling is allowed
+        can_split:  True if splitting is allowed
+    """
+    index = (1 if soft else 0) * TOTALS + total - 4
+    index = index * UPCARDS + upcard - 2
+    index = index * PAIRS + pair
+    index = index * 2 + (1 if can_double else 0)
+    return index * 2 + (1 if can_split else 0)
+
+
+def decode(index):
+    """Inverse of encode, returns a tuple of the same six fields"""
+    index, can_split = divmod(index, 2)
+    index, can_double = divmod(index, 2)
+    index, pair = divmod(index, PAIRS)
+    index, upcard = divmod(index, UPCARDS)
+    soft, total = divmod(index, TOTALS)
+    return (total + 4, bool(soft), upcard + 2, pair,
+            bool(can_double), bool(can_split))
+
+
+def describe(index):
+    """Readable form of an index, eg: 'H16-10 P8 DS' for a pair of 8s
+    that may be doubled or split
+    """
+    total, soft, upcard, pair, can_double, can_split = decode(index)
+    text = f"{'S' if soft else 'H'}{total}-{upcard}"
+    if pair:
+        text += f" P{pair}"
+    flags = ('D' if can_double else '') + ('S' if can_split else '')
+    if flags:
+        text += f" {flags}"
+    return text
@@ -0,0 +1,234 @@
+from reinforcementlearner import ExtendedLearner
+import math
+import mmap
+import os
+import stateindex
+import struct
+
+MAGIC = b'RLBJSTBL'
+VERSION = 1
+
+# magic, version, layout id, rule set key, slots, actions, padded to 64
+HEADER = struct.Struct('<8sII16sII24x')
+
+# Layout name: (id, number of slots, actions)
+LAYOUTS = {
+    'basic': (1, 2 * 18 * 10, ('hit', 'stand')),
+    'extended': (2, stateindex.SIZE, stateindex.ACTIONS)
+}
+
+
+def basic_slot(key):
+    """Slot of a key such as 'H16-10' in the basic layout
+
+    Returns:
+        The slot, or None for keys the layout cannot hold, such as the
+        count-indexed keys of a counting learner
+    """
+    if '@' in key:
+        return None
+    total, upcard = key[1:].split('-')
+    return ((key[0] == 'S') * 18 + int(total) - 4) * 10 + int(upcard) - 2
+
+
+def learner_values(learner):
+    """Average score of every tallied (key, action) of a learner
+
+    Returns:
+        A dict of {key: {action: value}} for write_table
+    """
+    values = {}
+    for key, actions in learner.export_table().items():
+        values[key] = {action: score / count
+                       for action, (score, count) in actions.items() if count}
+    return values
+
+
+def write_table(path, values, rules, layout='basic'):
+    """Writes a table of per-action values to a fixed-layout binary file
+
+    The file is a 64 byte header followed by one little-endian double per
+    (slot, action), NaN where there is no value. Values may be learned
+    averages or exact EVs from any source.
+
+    The table is written to a temporary file that then replaces `path`, so
+    a StrategyTable already mapping the old file keeps reading it intact.
+
+    Args:
+        path:   File to write
+        values: Dict of {key: {action: value}}. Keys are strings such as
+                'H16-10' for the basic layout and state indexes (or their
+                strings) for the extended layout. Keys the layout cannot
+                hold are skipped.
+        rules:  The RuleSet the values were computed under
+        layout: 'basic' or 'extended'
+    """
+    layout_id, slots, actions = LAYOUTS[layout]
+    body = [math.nan] * (slots * len(actions))
+    for key, action_values in values.items():
+        slot = basic_slot(key) if layout == 'basic' else int(key)
+        if slot is None:
+            continue
+        for action, value in action_values.items():
+            body[slot * len(actions) + actions.index(action)] = value
+
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, layout_id,
+                                rules.key.encode(), slots, len(actions)))
+            f.write(struct.pack(f'<{len(body)}d', *body))
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def export_strategy(learner, path):
+    """Writes a learner's averages with its rules and matching layout"""
+    layout = 'extended' if isinstance(learner, ExtendedLearner) else 'basic'
+    write_table(path, learner_values(learner), learner.game.game.rules,
+                layout)
+
+
+class StrategyTable:
+    """Read-only, memory-mapped view of a table written by write_table
+
+    Values are read straight out of the mapping rather than copied into
+    Python objects, so any number of processes opening the same file share
+    one physical copy through the page cache, and opening is immediate
+    whatever the size of the table.
+
+        table = StrategyTable('basic.tbl', rules=RuleSet(decks=6))
+        engine.play(table.policy, n=10**6)
+    """
+
+    def __init__(self, path, rules=None):
+        """Opens and validates a table
+
+        Args:
+            path:   File written by write_table
+            rules:  The RuleSet the table will be played under. If given,
+                    a table written for different rules is rejected.
+
+        Raises:
+            StaleTableError: For a table of another format version or
+                             written for other rules
+            ValueError:      If the file is not a valid table
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header(rules)
+        except Exception:
+            self._map.close()
+            raise
+        self._values = memoryview(self._map)[HEADER.size:].cast('d')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_header(self, rules):
+        """Checks the header and sets the layout attributes"""
+        if len(self._map) < HEADER.size:
+            raise ValueError("File is too short for a strategy table")
+        magic, version, layout_id, key, slots, width = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("Not a strategy table")
+        if version != VERSION:
+            raise StaleTableError(
+                f"Table format version {version}, expected {VERSION}")
+        if rules is not None and key.decode() != rules.key:
+            raise StaleTableError(
+                f"Table was written for rules {key.decode()}, "
+                f"not {rules.key}")
+
+        for name, (number, layout_slots, actions) in LAYOUTS.items():
+            if number == layout_id:
+                break
+        else:
+            raise ValueError(f"Unknown table layout {layout_id}")
+        if (slots, width) != (layout_slots, len(actions)) or \
+                len(self._map) != HEADER.size + 8 * slots * width:
+            raise ValueError("Table size does not match its layout")
+
+        self._layout = name
+        self._actions = actions
+        self._rules_key = key.decode()
+
+    @property
+    def layout(self):
+        """Name of the table's layout, 'basic' or 'extended'"""
+        return self._layout
+
+    @property
+    def actions(self):
+        """Tuple of the actions held per slot"""
+        return self._actions
+
+    @property
+    def rules_key(self):
+        """Key of the RuleSet the table was written for"""
+        return self._rules_key
+
+    def close(self):
+        """Releases the mapping"""
+        if self._map is not None:
+            self._values.release()
+            self._map.close()
+            self._map = None
+
+    def _slot(self, key):
+        """Slot of a key in this table's layout"""
+        if self._layout == 'basic':
+            return basic_slot(key)
+        return ExtendedLearner.index_for_key(key)
+
+    def value(self, key, action):
+        """Value of action for key, None if the table has none"""
+        slot = self._slot(key)
+        if slot is None:
+            return None
+        value = self._values[slot * len(self._actions) +
+                             self._actions.index(action)]
+        return None if math.isnan(value) else value
+
+    def action_for_key(self, key):
+        """Returns the action with the highest value, None if unknown"""
+        slot = self._slot(key)
+        if slot is None:
+            return None
+        width = len(self._actions)
+        row = self._values[slot * width:(slot + 1) * width]
+        best = None
+        for action, value in zip(self._actions, row):
+            if not math.isnan(value) and (best is None or value > best[0]):
+                best = (value, action)
+        return best and best[1]
+
+    def policy(self, total, soft, upcard):
+        """Hit/stand policy for FastEngine
+
+        When only one of the two actions has a value that action is
+        played, and states with neither stand.
+        """
+        slot = (soft * 18 + total - 4) * 10 + upcard - 2
+        if self._layout == 'extended':
+            slot = ExtendedLearner.index_for_key(
+                f"{'S' if soft else 'H'}{total}-{upcard}")
+        start = slot * len(self._actions)
+        hit, stand = self._values[start:start + 2]
+        if math.isnan(hit):
+            return 'stand'
+        if math.isnan(stand):
+            return 'hit'
+        return 'hit' if hit > stand else 'stand'
+
+
+class StaleTableError(Exception):
+    """Raised for a table of another format version or rule set"""
+    pass
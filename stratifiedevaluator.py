@@ -0,0 +1,259 @@
+from deck import infinite_values
+from fastengine import FastEngine, state_key
+from ruleset import RuleSet
+from statistics import NormalDist
+import math
+import random
+
+
+def shoe_counts(rules):
+    """Cards per value in a full shoe, Ace first, for the rules' deck count
+
+    An infinite deck is given the proportions of a single deck.
+    """
+    decks = max(rules.decks, 1)
+    return [4 * decks] * 9 + [16 * decks]
+
+
+def starting_strata(rules):
+    """Every (player two-card hand, dealer upcard) start and its probability
+
+    Probabilities are exact: cards are drawn without replacement from a full
+    shoe, or with replacement for an infinite deck. The dealer's hole card
+    is left out, it is dealt at random within each stratum.
+
+    Returns:
+        A list of (first, second, upcard, probability) tuples with
+        first <= second, values 1 (Ace) to 10
+    """
+    counts = shoe_counts(rules)
+    replace = rules.infinite
+
+    def take(value, remaining):
+        """Probability of drawing value, and the shoe after it"""
+        total = sum(remaining)
+        p = remaining[value - 1] / total
+        if not replace:
+            remaining = list(remaining)
+            remaining[value - 1] -= 1
+        return p, remaining
+
+    strata = []
+    for upcard in range(1, 11):
+        p_up, after_up = take(upcard, counts)
+        for first in range(1, 11):
+            p_first, after_first = take(first, after_up)
+            for second in range(first, 11):
+                p_second, _ = take(second, after_first)
+                p = p_up * p_first * p_second
+                # Both orders of two different cards give the same hand
+                if first != second:
+                    p *= 2
+                strata.append((first, second, upcard, p))
+    return strata
+
+
+def stratum_key(first, second, upcard):
+    """State key of a stratum's first decision, 'natural' for blackjacks"""
+    if {first, second} == {1, 10}:
+        return 'natural'
+    hard = first + second
+    soft = (first == 1 or second == 1) and hard <= 11
+    return state_key(hard + 10 if soft else hard, soft,
+                     11 if upcard == 1 else upcard)
+
+
+class StratumSource:
+    """Card source dealing a fixed start, then random cards
+
+    The draw order matches FastEngine.play_hand: upcard, hole card, then
+    the player's two cards. Every other card is drawn at random from what
+    is left of a full shoe, or from an infinite deck.
+    """
+
+    def __init__(self, rules, seed=None):
+        """Creates the source
+
+        Args:
+            rules:  The RuleSet giving the shoe size
+            seed:   Seed of the random cards
+        """
+        self._infinite = rules.infinite
+        self._shoe = shoe_counts(rules)
+        self._rng = random.Random(seed)
+        self._values = infinite_values(seed).__next__
+        self._forced = []
+        self._counts = None
+        self._total = 0
+
+    def start(self, first, second, upcard):
+        """Sets the start of the next hand"""
+        # Popped from the end, the hole card (None) is random
+        self._forced = [second, first, None, upcard]
+        if not self._infinite:
+            counts = list(self._shoe)
+            for value in (first, second, upcard):
+                counts[value - 1] -= 1
+            self._counts = counts
+            self._total = sum(counts)
+
+    def draw(self):
+        """Returns the next card value"""
+        if self._forced:
+            value = self._forced.pop()
+            if value is not None:
+                return value
+        if self._infinite:
+            return self._values()
+
+        pick = self._rng.randrange(self._total)
+        counts = self._counts
+        for index in range(10):
+            pick -= counts[index]
+            if pick < 0:
+                break
+        counts[index] -= 1
+        self._total -= 1
+        return index + 1
+
+
+class StratifiedEvaluator:
+    """Stratified Monte Carlo EV of a fixed hit/stand policy
+
+    Instead of dealing random starts, every (player hand, upcard) stratum
+    is played a planned number of times from the top of a fresh shoe and
+    the stratum means are recombined with their exact probabilities. The
+    variance from how often each start happens to come up is gone, and
+    every key gets the hands it was allocated.
+
+        evaluator = StratifiedEvaluator(basic_strategy, RuleSet(decks=6))
+        result = evaluator.evaluate(10**6, allocation='neyman')
+    """
+
+    ALLOCATIONS = ('proportional', 'equal', 'neyman')
+
+    def __init__(self, policy, rules=None, seed=None, engine=FastEngine):
+        """Creates the evaluator
+
+        Args:
+            policy: Function of (player_total, player_soft, dealer_upcard)
+                    returning 'hit' or 'stand'
+            rules:  The RuleSet to play by, the defaults if None
+            seed:   Seed of the random cards
+            engine: Engine class taking a card source and a RuleSet
+        """
+        self.policy = policy
+        self.rules = rules if rules is not None else RuleSet()
+        self.strata = starting_strata(self.rules)
+        self._source = StratumSource(self.rules, seed)
+        self._engine = engine(self._source, self.rules)
+
+    def allocate(self, n, allocation='proportional', stdevs=None,
+                 min_hands=2):
+        """Splits n hands between the strata
+
+        Args:
+            n:          Total hands
+            allocation: 'proportional' to probability, 'equal', or
+                        'neyman': proportional to probability times
+                        standard deviation, which needs stdevs
+            stdevs:     Standard deviation per stratum, for 'neyman'
+            min_hands:  Fewest hands per stratum
+
+        Returns:
+            A list of hands per stratum, in the order of self.strata
+        """
+        if allocation not in StratifiedEvaluator.ALLOCATIONS:
+            raise ValueError(f"Unknown allocation {allocation!r}")
+        if allocation == 'equal':
+            weights = [1.0] * len(self.strata)
+        elif allocation == 'proportional':
+            weights = [p for *_, p in self.strata]
+        else:
+            weights = [p * s for (*_, p), s in zip(self.strata, stdevs)]
+        total = math.fsum(weights) or 1.0
+        return [max(min_hands, round(n * w / total)) for w in weights]
+
+    def play_stratum(self, index, hands):
+        """Plays hands from one stratum
+
+        Returns:
+            A tuple of (hands, sum of scores, sum of squared scores)
+        """
+        first, second, upcard, _ = self.strata[index]
+        start = self._source.start
+        play_hand = self._engine.play_hand
+        policy = self.policy
+        total = 0.0
+        squares = 0.0
+        for _ in range(hands):
+            start(first, second, upcard)
+            score = play_hand(policy)
+            total += score
+            squares += score * score
+        return (hands, total, squares)
+
+    def evaluate(self, n, allocation='proportional', confidence=0.95,
+                 pilot=20):
+        """Estimates the policy's EV with about n hands
+
+        Args:
+            n:          Hands to play, split between the strata
+            allocation: See allocate
+            confidence: Confidence level of the intervals
+            pilot:      Hands per stratum played first to estimate the
+                        standard deviations for 'neyman'; they count
+                        towards the results
+
+        Returns:
+            A dict with the hands played, the EV, the confidence interval
+            and its half-width, and 'by_key': a dict of starting state key
+            (or 'natural') to its probability, hands, EV and half-width
+        """
+        sums = [(0, 0.0, 0.0)] * len(self.strata)
+        stdevs = None
+        if allocation == 'neyman':
+            sums = [self.play_stratum(i, pilot)
+                    for i in range(len(self.strata))]
+            stdevs = [self._stdev(*s) for s in sums]
+        plan = self.allocate(n, allocation, stdevs)
+
+        for i, hands in enumerate(plan):
+            more = hands - sums[i][0]
+            if more > 0:
+                played = self.play_stratum(i, more)
+                sums[i] = tuple(a + b for a, b in zip(sums[i], played))
+
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        keys = {}
+        for (first, second, upcard, p), (hands, total, squares) in \
+                zip(self.strata, sums):
+            key = keys.setdefault(stratum_key(first, second, upcard),
+                                  [0.0, 0, 0.0, 0.0])
+            key[0] += p
+            key[1] += hands
+            key[2] += p * total / hands
+            key[3] += p * p * self._stdev(hands, total, squares) ** 2 / hands
+
+        by_key = {}
+        for key, (p, hands, weighted, variance) in keys.items():
+            by_key[key] = {'probability': p, 'hands': hands,
+                           'ev': weighted / p,
+                           'half_width': z * math.sqrt(variance) / p}
+        ev = math.fsum(k[2] for k in keys.values())
+        half_width = z * math.sqrt(math.fsum(k[3] for k in keys.values()))
+        return {
+            'hands': sum(s[0] for s in sums),
+            'ev': ev,
+            'confidence': confidence,
+            'ci': (ev - half_width, ev + half_width),
+            'half_width': half_width,
+            'by_key': by_key
+        }
+
+    @staticmethod
+    def _stdev(n, total, squares):
+        """Sample standard deviation from running sums"""
+        if n < 2:
+            return 0.0
+        return math.sqrt(max(0.0, (squares - total * total / n) / (n - 1)))
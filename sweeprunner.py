@@ -0,0 +1,241 @@
+from reinforcementlearner import ReinforcementLearner, ExtendedLearner
+from ruleset import RuleSet
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+LEARNERS = {
+    'basic': ReinforcementLearner,
+    'extended': ExtendedLearner
+}
+
+# Run settings that are not rules, with their defaults
+RUN_DEFAULTS = {'learner': 'basic', 'track_count': False, 'n': 1000,
+                'seed': 0}
+
+# Modules whose code decides the result of a run
+ENGINE_MODULES = ('deck', 'ruleset', 'stateindex', 'blackjackgame',
+                  'blackjackgamerunner', 'blackjacktable',
+                  'reinforcementlearner', 'sweeprunner')
+
+
+def engine_version():
+    """Hash of the sources of ENGINE_MODULES
+
+    Part of every config hash, so runs cached by a different version of
+    the code are never reused.
+    """
+    digest = hashlib.sha256()
+    for name in ENGINE_MODULES:
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+ENGINE_VERSION = engine_version()
+
+
+def expand_grid(spec):
+    """Expands a grid spec into the list of run configs it describes
+
+    Args:
+        spec:   Dict of setting name to a list of values, eg:
+                {'learner': ['basic'], 'decks': [1, 6], 'seed': [0, 1]}.
+                Settings are the keys of RUN_DEFAULTS and the RuleSet
+                fields. A single value stands for a list of one.
+
+    Returns:
+        A list of configs, one per combination of values
+    """
+    names = sorted(spec)
+    values = [v if isinstance(v, (list, tuple)) else [v]
+              for v in (spec[name] for name in names)]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def normalize_config(config):
+    """Fills in defaults so that equivalent configs are identical
+
+    Returns:
+        A dict of the run settings plus a 'rules' dict of every RuleSet
+        field
+
+    Raises:
+        ValueError: For unknown settings or learners, or a count tracked by
+                    the extended learner
+    """
+    normalized = dict(RUN_DEFAULTS)
+    rules = {}
+    for name, value in config.items():
+        if name in RUN_DEFAULTS:
+            normalized[name] = value
+        elif name in RuleSet.FIELDS:
+            rules[name] = value
+        else:
+            raise ValueError(f"Unknown sweep setting {name!r}")
+    if normalized['learner'] not in LEARNERS:
+        raise ValueError(f"Unknown learner {normalized['learner']!r}")
+    if normalized['learner'] == 'extended' and normalized['track_count']:
+        raise ValueError("The extended learner does not track the count")
+    normalized['rules'] = RuleSet(**rules).as_dict()
+    return normalized
+
+
+def config_hash(config):
+    """Stable content hash of a config and ENGINE_VERSION
+
+    The same in every process running the same code.
+    """
+    text = json.dumps({'config': normalize_config(config),
+                       'engine': ENGINE_VERSION}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def run_config(config):
+    """Runs the explorer for one config
+
+    The learner draws from its own random.Random seeded with the config's
+    seed, so the random module's state is left alone.
+
+    Returns:
+        The learner's outcomes as returned by export_table
+    """
+    config = normalize_config(config)
+    learner = LEARNERS[config['learner']](
+        config['track_count'], rules=RuleSet(**config['rules']),
+        rng=random.Random(config['seed']))
+    learner.run_explorer(n=config['n'])
+    return learner.export_table()
+
+
+def best_actions(table):
+    """Best action of every key of an exported outcome table"""
+    best = {}
+    for key, actions in table.items():
+        values = [(score / count, action)
+                  for action, (score, count) in actions.items() if count]
+        if values:
+            best[key] = max(values)[1]
+    return best
+
+
+def _run_cell(config):
+    """Pool target returning the config's hash with its table"""
+    return config_hash(config), run_config(config)
+
+
+class SweepRunner:
+    """Runs grids of learner configs on a process pool with a disk cache
+
+    Each finished run is written to `<cache_dir>/<hash>.json`, where the
+    hash is taken over the normalized config. Any later sweep containing an
+    equivalent config reads that file instead of running it again, so
+    repeating or extending a sweep only runs the new cells.
+
+        runner = SweepRunner('sweeps')
+        results = runner.run({'decks': [1, 6], 'n': [10**5],
+                              'seed': [0, 1, 2]}, 'sweep.json')
+    """
+
+    def __init__(self, cache_dir, processes=None):
+        """Creates a runner
+
+        Args:
+            cache_dir:  Directory of cached runs, created if missing
+            processes:  Pool size, the number of CPUs if None. With 1, runs
+                        happen in this process.
+        """
+        self.cache_dir = cache_dir
+        self.processes = processes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._ran = 0
+        self._cached = 0
+
+    def path(self, config):
+        """Path of the cache file for config"""
+        return os.path.join(self.cache_dir, f"{config_hash(config)}.json")
+
+    def load(self, config):
+        """Returns the cached table for config, None if it has not run"""
+        try:
+            with open(self.path(config)) as f:
+                return json.load(f)['table']
+        except FileNotFoundError:
+            return None
+
+    def _save(self, digest, config, table):
+        """Writes a finished run, atomically so partial files never exist"""
+        path = os.path.join(self.cache_dir, f"{digest}.json")
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, 'w') as f:
+                json.dump({'config': normalize_config(config),
+                           'engine': ENGINE_VERSION, 'table': table},
+                          f, separators=(',', ':'))
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def stats(self):
+        """Returns a dict of how many cells were run and read from cache"""
+        return {'ran': self._ran, 'cached': self._cached}
+
+    def run(self, spec, results_path=None):
+        """Runs every cell of a sweep that is not cached yet
+
+        Args:
+            spec:           Grid spec for expand_grid, or a list of configs
+            results_path:   If given, the consolidated results are written
+                            there as JSON
+
+        Returns:
+            A list with a dict per cell, in grid order, holding its config,
+            hash, whether it came from the cache and its best actions
+        """
+        configs = expand_grid(spec) if isinstance(spec, dict) else spec
+        digests = [config_hash(config) for config in configs]
+
+        tables = {}
+        todo = {}
+        for digest, config in zip(digests, configs):
+            if digest in tables or digest in todo:
+                continue
+            table = self.load(config)
+            if table is None:
+                todo[digest] = config
+            else:
+                tables[digest] = table
+        cached = set(tables)
+
+        if todo:
+            if self.processes == 1:
+                finished = map(_run_cell, todo.values())
+                self._collect(finished, todo, tables)
+            else:
+                with multiprocessing.Pool(self.processes) as pool:
+                    finished = pool.imap_unordered(_run_cell, todo.values())
+                    self._collect(finished, todo, tables)
+        self._ran += len(todo)
+        self._cached += len(cached)
+
+        results = []
+        for digest, config in zip(digests, configs):
+            results.append({'config': normalize_config(config),
+                            'hash': digest,
+                            'cached': digest in cached,
+                            'best_actions': best_actions(tables[digest])})
+        if results_path is not None:
+            with open(results_path, 'w') as f:
+                json.dump(results, f, indent=1)
+        return results
+
+    def _collect(self, finished, todo, tables):
+        """Saves runs as they finish, so an interrupted sweep keeps them"""
+        for digest, table in finished:
+            self._save(digest, todo[digest], table)
+            tables[digest] = table